@@ -0,0 +1,160 @@
+"""
+Fetching of RSS feeds, for tg_bot's rss module.
+
+Like feed_worker, this lives outside the tg_bot package so that it can be imported - and tested - without running the
+package __init__ (config, the Application, the database). The fetcher the bot uses is set up in
+tg_bot.modules.helper_funcs.feed_fetcher.
+"""
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = "tg_bot RSS reader"
+
+
+Validators = Tuple[Optional[str], Optional[str]]
+
+
+class FetchResult(object):
+    def __init__(self, url: str, status: int, body: Optional[bytes] = None, error: Optional[str] = None,
+                 validators: Optional[Validators] = None):
+        self.url = url
+        self.status = status
+        self.body = body
+        self.error = error
+        # the ETag and Last-Modified of a full fetch, for FeedFetcher.remember
+        self.validators = validators
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.body is not None
+
+    def __repr__(self):
+        return "<FetchResult {} ({})>".format(self.url, self.error or self.status)
+
+
+class FeedFetcher(object):
+    """
+    Fetches feeds over a pooled HTTP session, a bounded number at a time.
+
+    Once a fetched feed has been dealt with, remember() keeps its ETag and Last-Modified headers to send back on the
+    next fetch, so feeds which haven't changed since cost a 304 and no parsing. A fetch that is never remembered, eg
+    because its feed didn't parse, is fetched in full again next time.
+    """
+
+    def __init__(self, concurrency: int, timeout: float, max_bytes: int, logger: Optional[logging.Logger] = None):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self._session = None  # type: Optional[requests.Session]
+        self._validators = {}  # type: Dict[str, Validators]
+        self.logger = logger or logging.getLogger(__name__)
+
+        self.fetched = 0
+        self.not_modified = 0
+        self.failed = 0
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = USER_AGENT
+            self._session = session
+        return self._session
+
+    def _read_capped(self, res: requests.Response) -> Optional[bytes]:
+        body = bytearray()
+        for chunk in res.iter_content(64 * 1024):
+            body.extend(chunk)
+            if len(body) > self.max_bytes:
+                return None
+        return bytes(body)
+
+    def get(self, url: str, conditional: bool = True) -> FetchResult:
+        """
+        Fetch a feed, blocking. fetch and fetch_all are the async versions.
+
+        Args:
+            url: The feed URL.
+            conditional: Whether to send the remembered validators. Pass False to always get the full feed.
+        """
+        headers = {}
+        etag, last_modified = self._validators.get(url, (None, None)) if conditional else (None, None)
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        try:
+            with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as res:
+                if res.status_code == 304:
+                    self.not_modified += 1
+                    return FetchResult(url, 304)
+
+                if res.status_code != 200:
+                    self.failed += 1
+                    return FetchResult(url, res.status_code, error="HTTP {}".format(res.status_code))
+
+                body = self._read_capped(res)
+                if body is None:
+                    self.failed += 1
+                    return FetchResult(url, 200, error="feed is over {} bytes".format(self.max_bytes))
+
+                validators = (res.headers.get("ETag"), res.headers.get("Last-Modified"))
+        except requests.RequestException as excp:
+            self.failed += 1
+            return FetchResult(url, 0, error=str(excp))
+
+        self.fetched += 1
+        return FetchResult(url, 200, body=body, validators=validators)
+
+    async def fetch(self, url: str) -> FetchResult:
+        return await asyncio.to_thread(self.get, url)
+
+    async def fetch_all(self, urls: Iterable[str]) -> Dict[str, FetchResult]:
+        """
+        Fetch each distinct URL once.
+
+        Args:
+            urls: The feed URLs; duplicates are only fetched once.
+
+        Returns:
+            A dict of URL to its FetchResult.
+        """
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def fetch_one(url):
+            async with slots:
+                return await self.fetch(url)
+
+        unique = list(dict.fromkeys(urls))
+        results = await asyncio.gather(*(fetch_one(url) for url in unique))
+        for result in results:
+            if result.error:
+                self.logger.debug("Couldn't fetch feed %s: %s", result.url, result.error)
+        return dict(zip(unique, results))
+
+    def remember(self, result: FetchResult) -> None:
+        """
+        Keep the validators of a full fetch, to be sent with the next fetch of the same URL. Only call this once the
+        fetched feed has been parsed and its entries recorded, or a failure would be skipped over by the next 304.
+
+        Args:
+            result: The fetch, as returned by get, fetch or fetch_all.
+        """
+        if result.ok and result.validators and any(result.validators):
+            self._validators[result.url] = result.validators
+
+    def __stats__(self) -> str:
+        return "RSS fetches: {} full, {} not modified, {} failed.".format(self.fetched, self.not_modified,
+                                                                         self.failed)
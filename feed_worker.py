@@ -0,0 +1,26 @@
+"""
+The part of RSS parsing that runs in tg_bot's parser processes.
+
+This lives outside the tg_bot package on purpose: the parser processes are started fresh rather than forked from the
+bot, and importing anything under tg_bot would run the package __init__ in each of them - config, the Application,
+the database. This module only needs feedparser.
+"""
+from typing import Any, Dict
+
+from feedparser import parse
+
+
+def parse_feed(data: bytes, max_entries: int) -> Dict[str, Any]:
+    # Only plain, picklable data goes back, and only what the rss module uses.
+    parsed = parse(data)
+    entries = parsed.entries[:max_entries]
+    return {
+        "bozo": bool(parsed.bozo),
+        "title": parsed.feed.get("title"),
+        "link": parsed.feed.get("link"),
+        "description": parsed.feed.get("description"),
+        "latest_description": entries[0].get("description") if entries else None,
+        "entries": [{"title": entry.get("title", ""),
+                     "link": entry.get("link", ""),
+                     "guid": entry.get("id") or entry.get("link", "")} for entry in entries],
+    }
@@ -0,0 +1,72 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from feed_fetch import FeedFetcher
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    # set by the tests: the feed's current body and ETag
+    body = b""
+    etag = ""
+    seen_etags = []
+
+    def do_GET(self):
+        sent = self.headers.get("If-None-Match")
+        FeedHandler.seen_etags.append(sent)
+        if sent == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestFeedFetcher(unittest.TestCase):
+    def setUp(self):
+        FeedHandler.body = b"<rss>v1</rss>"
+        FeedHandler.etag = '"v1"'
+        FeedHandler.seen_etags = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/feed".format(self.server.server_address[1])
+        self.fetcher = FeedFetcher(concurrency=2, timeout=5, max_bytes=1024)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_validators_only_sent_once_remembered(self):
+        # 200: a full fetch, whose validators aren't used until the feed has been dealt with
+        first = self.fetcher.get(self.url)
+        self.assertEqual(first.status, 200)
+        self.assertEqual(first.body, b"<rss>v1</rss>")
+        self.assertEqual(first.validators, ('"v1"', None))
+        self.fetcher.remember(first)
+
+        # 304: nothing changed since the remembered fetch
+        self.assertTrue(self.fetcher.get(self.url).not_modified)
+        self.assertEqual(FeedHandler.seen_etags, [None, '"v1"'])
+
+        # the feed changes, but this version fails to parse, so it's never remembered...
+        FeedHandler.body = b"<rss>v2 <broken"
+        FeedHandler.etag = '"v2"'
+        broken = self.fetcher.get(self.url)
+        self.assertTrue(broken.ok)
+
+        # ...and the next poll fetches it in full again, instead of getting a 304 and skipping it for good
+        retry = self.fetcher.get(self.url)
+        self.assertEqual(retry.status, 200)
+        self.assertEqual(retry.body, b"<rss>v2 <broken")
+        self.assertEqual(FeedHandler.seen_etags[-1], '"v1"')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@ import importlib
 import re
 from typing import Optional, List, Dict, Tuple, Union
 
+import telegram.ext
 from telegram import Update, Bot, User, Chat
 from telegram import ParseMode, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.error import (
@@ -27,8 +28,19 @@ from telegram.utils.helpers import escape_markdown
 # NOTE: Module order is not guaranteed, specify that in the config file!
 from tg_bot import dispatcher, updater, TOKEN, WEBHOOK, OWNER_ID, DONATION_LINK, CERT_PATH, PORT, URL, LOGGER, ALLOW_EXCL
 from tg_bot.modules import ALL_MODULES
+from tg_bot.modules.helper_funcs.chat_features import group_can_act
 from tg_bot.modules.helper_funcs.chat_status import is_user_admin
+from tg_bot.modules.helper_funcs.legacy_executor import LEGACY_EXECUTOR, is_legacy_callback, run_legacy_handler
 from tg_bot.modules.helper_funcs.misc import paginate_modules
+from tg_bot.modules.helper_funcs.outbound import OUTBOUND
+from tg_bot.modules.helper_funcs.routing import get_handler_index
+from tg_bot.modules.helper_funcs.update_context import open_update_context, close_update_context
+from tg_bot.modules.helper_funcs.update_lanes import UPDATE_LANES
+
+# Legacy modules raise PTB 11's DispatcherHandlerStop, ported ones PTB 20's ApplicationHandlerStop; only one of the
+# two exists in the installed version. Either one means no later handler group gets the update.
+HANDLER_STOP = tuple(getattr(telegram.ext, name) for name in ("ApplicationHandlerStop", "DispatcherHandlerStop")
+                     if hasattr(telegram.ext, name))
 
 # Moved here to avoid potential issues with undefined variables.
 PM_START_TEXT = """
@@ -155,6 +167,11 @@ for module_name in ALL_MODULES:
     except ImportError as exc:
         LOGGER.warning("Can't import module %s, due to error %s", module_name, exc)
 
+# lane depth/latency, legacy pool and outbound queue metrics show up in /stats next to the module counts
+STATS.append(UPDATE_LANES)
+STATS.append(LEGACY_EXECUTOR)
+STATS.append(OUTBOUND)
+
 
 async def send_help(chat_id: int, text: str, keyboard: Optional[InlineKeyboardMarkup] = None) -> None:
     """Sends help text to the chat.
@@ -585,8 +602,17 @@ async def process_update(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await error_handler(update, context)
         return
 
+    OUTBOUND.start()
+
+    # updates of one chat are handled in order; different chats run in parallel. Only queue it here, so a busy chat
+    # doesn't keep one of the application's update slots taken while its lane catches up.
+    chat_id = update.effective_chat.id if update.effective_chat else None
+    await UPDATE_LANES.enqueue(chat_id, handle_chat_update, update, context)
+
+
+async def handle_chat_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Runs the handlers for a single update, inside its chat's lane."""
     now = datetime.datetime.utcnow()
-    chat_id = update.effective_chat.id
     # Use chat_data for persistence
     cnt = context.chat_data.get("CHATS_CNT", 0)
     t = context.chat_data.get("CHATS_TIME", datetime.datetime(1970, 1, 1))
@@ -601,22 +627,43 @@ async def process_update(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     context.chat_data["CHATS_CNT"] = cnt
-    # print(f"Handlers are {application.handlers}") # For Debug
-    if application.handlers and application.handlers.get(0):
-      for group in application.handlers.get(0): # changed from application.groups to application.handlers[0]
-          try:
-              if group and group.check_update(update):
-                  await group.handle_update(update, context)
-                  #   break # Removed break
-          except ConversationHandler.End:
-              LOGGER.debug('Stopping further handlers due to ConversationHandler.End')
-              return
-          except TelegramError as te:
-              LOGGER.warning('A TelegramError was raised while processing the Update')
-              await error_handler(update, context)
-              return
-          except Exception:
-              LOGGER.exception('An uncaught error was raised while processing the update')
+    # text, entities, admin status, ... are worked out once here and shared by every module's handler
+    open_update_context(update)
+    try:
+        await dispatch_update(update, context)
+    finally:
+        close_update_context(update)
+
+
+async def dispatch_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Offers an update to the handlers that could match it."""
+    # only offer the update to handlers that could match its kind/command, in group order - first match per group
+    chat_id = update.effective_chat.id if update.effective_chat else None
+    handled_group = None
+    for group, _, handler in get_handler_index(application.handlers).candidates(update):
+        if group == handled_group or not group_can_act(group, chat_id):
+            # skip moderation groups with nothing configured in this chat
+            continue
+        try:
+            if handler.check_update(update):
+                handled_group = group
+                if is_legacy_callback(handler.callback):
+                    # old (bot, update) handlers block - keep them off the event loop, in chat order
+                    await run_legacy_handler(handler, update, context)
+                else:
+                    await handler.handle_update(update, context)
+        except HANDLER_STOP:
+            LOGGER.debug('Stopping further handlers due to a handler stop')
+            return
+        except ConversationHandler.End:
+            LOGGER.debug('Stopping further handlers due to ConversationHandler.End')
+            return
+        except TelegramError as te:
+            LOGGER.warning('A TelegramError was raised while processing the Update')
+            await error_handler(update, context)
+            return
+        except Exception:
+            LOGGER.exception('An uncaught error was raised while processing the update')
 
 
 
@@ -657,10 +704,11 @@ def main() -> None:
             port=PORT,
             webhook_url=URL + TOKEN,
             cert=CERT_PATH if CERT_PATH else None,
+            allowed_updates=Update.ALL_TYPES,  # chat_member updates keep the admin cache fresh
         )
     else:
         LOGGER.info("Using long polling.")
-        application.run_polling(timeout=15, read_timeout=20) # Read timeout added
+        application.run_polling(timeout=15, read_timeout=20, allowed_updates=Update.ALL_TYPES) # Read timeout added
     # application.run_polling(allowed_updates=Update.ALL, timeout=15, read_latency=4) # Removed read_latency, added allowed_updates
 
 
@@ -4,13 +4,14 @@ from typing import Optional, List
 from telegram import Message, Chat, Update, Bot, User
 from telegram import ParseMode
 from telegram.error import BadRequest
-from telegram.ext import CommandHandler, Filters
+from telegram.ext import CommandHandler, Filters, ChatMemberHandler
 from telegram.ext.dispatcher import run_async
 from telegram.utils.helpers import escape_markdown, mention_html
 
 from tg_bot import dispatcher
 from tg_bot.modules.disable import DisableAbleCommandHandler
-from tg_bot.modules.helper_funcs.chat_status import bot_admin, can_promote, user_admin, can_pin
+from tg_bot.modules.helper_funcs.chat_status import bot_admin, can_promote, user_admin, can_pin, \
+    invalidate_admin_cache, set_bot_member
 from tg_bot.modules.helper_funcs.extraction import extract_user
 from tg_bot.modules.log_channel import loggable
 
@@ -52,6 +53,7 @@ def promote(bot: Bot, update: Update, args: List[str]) -> str:
                           can_restrict_members=bot_member.can_restrict_members,
                           can_pin_messages=bot_member.can_pin_messages,
                           can_promote_members=bot_member.can_promote_members)
+    invalidate_admin_cache(chat.id)
 
     message.reply_text("Successfully promoted!")
     return "<b>{}:</b>" \
@@ -100,6 +102,7 @@ def demote(bot: Bot, update: Update, args: List[str]) -> str:
                               can_restrict_members=False,
                               can_pin_messages=False,
                               can_promote_members=False)
+        invalidate_admin_cache(chat.id)
         message.reply_text("Successfully demoted!")
         return "<b>{}:</b>" \
                "\n#DEMOTED" \
@@ -201,6 +204,22 @@ def adminlist(bot: Bot, update: Update):
     update.effective_message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
 
 
+def admin_status_update(bot: Bot, update: Update):
+    # someone was promoted, demoted, or left - the cached admin list of this chat is no longer trustworthy
+    member_update = update.chat_member
+    old_status = member_update.old_chat_member.status
+    new_status = member_update.new_chat_member.status
+    if old_status in ("administrator", "creator") or new_status in ("administrator", "creator"):
+        invalidate_admin_cache(member_update.chat.id)
+
+
+def bot_status_update(bot: Bot, update: Update):
+    # the bot's own rights changed - keep the snapshot used by the can_* checks in sync without an API call
+    member_update = update.my_chat_member
+    set_bot_member(member_update.chat.id, member_update.new_chat_member)
+    invalidate_admin_cache(member_update.chat.id)
+
+
 def __chat_settings__(chat_id, user_id):
     return "You are *admin*: `{}`".format(
         dispatcher.bot.get_chat_member(chat_id, user_id).status in ("administrator", "creator"))
@@ -229,9 +248,14 @@ DEMOTE_HANDLER = CommandHandler("demote", demote, pass_args=True, filters=Filter
 
 ADMINLIST_HANDLER = DisableAbleCommandHandler("adminlist", adminlist, filters=Filters.group)
 
+ADMIN_STATUS_HANDLER = ChatMemberHandler(admin_status_update, ChatMemberHandler.CHAT_MEMBER)
+BOT_STATUS_HANDLER = ChatMemberHandler(bot_status_update, ChatMemberHandler.MY_CHAT_MEMBER)
+
 dispatcher.add_handler(PIN_HANDLER)
 dispatcher.add_handler(UNPIN_HANDLER)
 dispatcher.add_handler(INVITE_HANDLER)
 dispatcher.add_handler(PROMOTE_HANDLER)
 dispatcher.add_handler(DEMOTE_HANDLER)
 dispatcher.add_handler(ADMINLIST_HANDLER)
+dispatcher.add_handler(ADMIN_STATUS_HANDLER)
+dispatcher.add_handler(BOT_STATUS_HANDLER)
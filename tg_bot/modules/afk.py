@@ -6,6 +6,7 @@ from telegram.ext import Filters, MessageHandler, run_async
 
 from tg_bot import dispatcher
 from tg_bot.modules.disable import DisableAbleCommandHandler, DisableAbleRegexHandler
+from tg_bot.modules.helper_funcs.update_context import get_update_context
 from tg_bot.modules.sql import afk_sql as sql
 from tg_bot.modules.users import get_user_id
 
@@ -39,16 +40,17 @@ def no_longer_afk(bot: Bot, update: Update):
 
 @run_async
 def reply_afk(bot: Bot, update: Update):
-    message = update.effective_message  # type: Optional[Message]
-    entities = message.parse_entities([MessageEntity.TEXT_MENTION, MessageEntity.MENTION])
+    ctx = get_update_context(update)
+    message = ctx.message  # type: Optional[Message]
+    entities = ctx.entities_of_type(MessageEntity.TEXT_MENTION, MessageEntity.MENTION)
     if message.entities and entities:
-        for ent in entities:
+        for ent, ent_text in entities.items():
             if ent.type == MessageEntity.TEXT_MENTION:
                 user_id = ent.user.id
                 fst_name = ent.user.first_name
 
             elif ent.type == MessageEntity.MENTION:
-                user_id = get_user_id(message.text[ent.offset:ent.offset + ent.length])
+                user_id = get_user_id(ent_text)
                 if not user_id:
                     # Should never happen, since for a user to become AFK they must have spoken. Maybe changed username?
                     return
@@ -7,7 +7,9 @@ from telegram.ext import Filters, MessageHandler, CommandHandler, run_async
 from telegram.utils.helpers import mention_html
 
 from tg_bot import dispatcher
-from tg_bot.modules.helper_funcs.chat_status import is_user_admin, user_admin, can_restrict
+from tg_bot.modules.helper_funcs.chat_features import register_group_feature
+from tg_bot.modules.helper_funcs.chat_status import user_admin, can_restrict
+from tg_bot.modules.helper_funcs.update_context import get_update_context
 from tg_bot.modules.log_channel import loggable
 from tg_bot.modules.sql import antiflood_sql as sql
 
@@ -17,15 +19,16 @@ FLOOD_GROUP = 3
 @run_async
 @loggable
 def check_flood(bot: Bot, update: Update) -> str:
-    user = update.effective_user  # type: Optional[User]
-    chat = update.effective_chat  # type: Optional[Chat]
-    msg = update.effective_message  # type: Optional[Message]
+    ctx = get_update_context(update)
+    user = ctx.user  # type: Optional[User]
+    chat = ctx.chat  # type: Optional[Chat]
+    msg = ctx.message  # type: Optional[Message]
 
     if not user:  # ignore channels
         return ""
 
     # ignore admins
-    if is_user_admin(chat, user.id):
+    if ctx.sender_is_admin():
         sql.update_flood(chat.id, None)
         return ""
 
@@ -134,5 +137,6 @@ SET_FLOOD_HANDLER = CommandHandler("setflood", set_flood, pass_args=True, filter
 FLOOD_HANDLER = CommandHandler("flood", flood, filters=Filters.group)
 
 dispatcher.add_handler(FLOOD_BAN_HANDLER, FLOOD_GROUP)
+register_group_feature(FLOOD_GROUP, "antiflood")
 dispatcher.add_handler(SET_FLOOD_HANDLER)
 dispatcher.add_handler(FLOOD_HANDLER)
@@ -1,5 +1,4 @@
 import html
-import re
 from typing import Optional, List
 
 from telegram import Message, Chat, Update, Bot, ParseMode
@@ -9,9 +8,10 @@ from telegram.ext import CommandHandler, MessageHandler, Filters, run_async
 import tg_bot.modules.sql.blacklist_sql as sql
 from tg_bot import dispatcher, LOGGER
 from tg_bot.modules.disable import DisableAbleCommandHandler
+from tg_bot.modules.helper_funcs.chat_features import register_group_feature
 from tg_bot.modules.helper_funcs.chat_status import user_admin, user_not_admin
-from tg_bot.modules.helper_funcs.extraction import extract_text
 from tg_bot.modules.helper_funcs.misc import split_message
+from tg_bot.modules.helper_funcs.update_context import get_update_context
 
 BLACKLIST_GROUP = 11
 
@@ -110,24 +110,20 @@ def unblacklist(bot: Bot, update: Update):
 @run_async
 @user_not_admin
 def del_blacklist(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    message = update.effective_message  # type: Optional[Message]
-    to_match = extract_text(message)
-    if not to_match:
+    ctx = get_update_context(update)
+    chat = ctx.chat  # type: Optional[Chat]
+    message = ctx.message  # type: Optional[Message]
+    if not ctx.text:
         return
 
-    chat_filters = sql.get_chat_blacklist(chat.id)
-    for trigger in chat_filters:
-        pattern = r"( |^|[^\w])" + re.escape(trigger) + r"( |$|[^\w])"
-        if re.search(pattern, to_match, flags=re.IGNORECASE):
-            try:
-                message.delete()
-            except BadRequest as excp:
-                if excp.message == "Message to delete not found":
-                    pass
-                else:
-                    LOGGER.exception("Error while deleting blacklist message.")
-            break
+    if sql.find_blacklisted(chat.id, ctx.folded_text, folded=True):
+        try:
+            message.delete()
+        except BadRequest as excp:
+            if excp.message == "Message to delete not found":
+                pass
+            else:
+                LOGGER.exception("Error while deleting blacklist message.")
 
 
 def __migrate__(old_chat_id, new_chat_id):
@@ -173,3 +169,4 @@ dispatcher.add_handler(BLACKLIST_HANDLER)
 dispatcher.add_handler(ADD_BLACKLIST_HANDLER)
 dispatcher.add_handler(UNBLACKLIST_HANDLER)
 dispatcher.add_handler(BLACKLIST_DEL_HANDLER, group=BLACKLIST_GROUP)
+register_group_feature(BLACKLIST_GROUP, "blacklist")
@@ -1,4 +1,3 @@
-import re
 from typing import Optional
 
 import telegram
@@ -10,11 +9,12 @@ from telegram.utils.helpers import escape_markdown
 
 from tg_bot import dispatcher, LOGGER
 from tg_bot.modules.disable import DisableAbleCommandHandler
+from tg_bot.modules.helper_funcs.chat_features import register_group_feature
 from tg_bot.modules.helper_funcs.chat_status import user_admin
-from tg_bot.modules.helper_funcs.extraction import extract_text
 from tg_bot.modules.helper_funcs.filters import CustomFilters
 from tg_bot.modules.helper_funcs.misc import build_keyboard
 from tg_bot.modules.helper_funcs.string_handling import split_quotes, button_markdown_parser
+from tg_bot.modules.helper_funcs.update_context import get_update_context
 from tg_bot.modules.sql import cust_filters_sql as sql
 
 HANDLER_GROUP = 10
@@ -143,17 +143,16 @@ def stop_filter(bot: Bot, update: Update):
 
 @run_async
 def reply_filter(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    message = update.effective_message  # type: Optional[Message]
-    to_match = extract_text(message)
-    if not to_match:
+    ctx = get_update_context(update)
+    chat = ctx.chat  # type: Optional[Chat]
+    message = ctx.message  # type: Optional[Message]
+    if not ctx.text:
         return
 
-    chat_filters = sql.get_chat_triggers(chat.id)
-    for keyword in chat_filters:
-        pattern = r"( |^|[^\w])" + re.escape(keyword) + r"( |$|[^\w])"
-        if re.search(pattern, to_match, flags=re.IGNORECASE):
-            filt = sql.get_filter(chat.id, keyword)
+    keyword = sql.find_chat_trigger(chat.id, ctx.folded_text, folded=True)
+    if keyword:
+        filt = sql.get_filter(chat.id, keyword)
+        if filt:
             if filt.is_sticker:
                 message.reply_sticker(filt.reply)
             elif filt.is_document:
@@ -193,7 +192,6 @@ def reply_filter(bot: Bot, update: Update):
             else:
                 # LEGACY - all new filters will have has_markdown set to True.
                 message.reply_text(filt.reply)
-            break
 
 
 def __stats__():
@@ -231,3 +229,4 @@ dispatcher.add_handler(FILTER_HANDLER)
 dispatcher.add_handler(STOP_HANDLER)
 dispatcher.add_handler(LIST_HANDLER)
 dispatcher.add_handler(CUST_FILTER_HANDLER, HANDLER_GROUP)
+register_group_feature(HANDLER_GROUP, "filters")
@@ -1,6 +1,11 @@
+import asyncio
+import csv
 import html
-from io import BytesIO
-from typing import Optional, List
+import json
+import time
+from io import BytesIO, TextIOWrapper
+from itertools import chain
+from typing import Optional, List, Iterator, Tuple
 
 from telegram import Message, Update, Bot, User, Chat, ParseMode
 from telegram.error import BadRequest, TelegramError
@@ -8,12 +13,14 @@ from telegram.ext import run_async, CommandHandler, MessageHandler, Filters
 from telegram.utils.helpers import mention_html
 
 import tg_bot.modules.sql.global_bans_sql as sql
-from tg_bot import dispatcher, OWNER_ID, SUDO_USERS, SUPPORT_USERS, STRICT_GBAN
-from tg_bot.modules.helper_funcs.chat_status import user_admin, is_user_admin
+from tg_bot import dispatcher, job_queue, SUDO_USERS, SUPPORT_USERS, STRICT_GBAN, LOGGER
+from tg_bot.modules.helper_funcs.chat_status import user_admin, is_user_admin_sync
 from tg_bot.modules.helper_funcs.extraction import extract_user, extract_user_and_text
 from tg_bot.modules.helper_funcs.filters import CustomFilters
 from tg_bot.modules.helper_funcs.misc import send_to_list
-from tg_bot.modules.sql.users_sql import get_all_chats
+from tg_bot.modules.helper_funcs.outbound import OUTBOUND, PRIORITY_MODERATION, PRIORITY_BULK
+from tg_bot.modules.helper_funcs.update_context import get_update_context
+from tg_bot.modules.sql.users_sql import get_user_chat_ids, get_live_chat_ids_after, is_chat_dead, get_memberships
 
 GBAN_ENFORCE_GROUP = 6
 
@@ -43,6 +50,97 @@ UNGBAN_ERRORS = {
     "Peer_id_invalid",
 }
 
+GBAN_CONCURRENCY = 10
+GBAN_SWEEP_BATCH_SIZE = 200
+GBAN_REPORT_INTERVAL = 60
+# imported users are looked up in ChatMembers this many at a time
+GBAN_IMPORT_BATCH_SIZE = 500
+
+
+async def gban_in_chat(bot: Bot, chat_id: str, user_id: int, priority: int = PRIORITY_MODERATION):
+    await OUTBOUND.call(None, priority, bot.kick_chat_member, chat_id, user_id)
+
+
+async def ungban_in_chat(bot: Bot, chat_id: str, user_id: int):
+    member = await OUTBOUND.call(None, PRIORITY_MODERATION, bot.get_chat_member, chat_id, user_id)
+    if member.status == 'kicked':
+        await OUTBOUND.call(None, PRIORITY_MODERATION, bot.unban_chat_member, chat_id, user_id)
+
+
+# action -> (what to do in each chat, errors which just mean there's nothing to do in that chat)
+FANOUT_ACTIONS = {
+    "gban": (gban_in_chat, GBAN_ERRORS),
+    "un-gban": (ungban_in_chat, UNGBAN_ERRORS),
+}
+
+
+async def run_fanout(context):
+    action, user_id = context.job.data
+    act, harmless_errors = FANOUT_ACTIONS[action]
+    bot = context.bot
+    slots = asyncio.Semaphore(GBAN_CONCURRENCY)
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+    fatal = []
+    last_report = time.monotonic()
+
+    async def report(text):
+        await asyncio.to_thread(send_to_list, bot, SUDO_USERS + SUPPORT_USERS, text)
+
+    async def act_in(chat_id):
+        async with slots:
+            if fatal:
+                return
+            try:
+                await act(bot, chat_id, user_id)
+            except BadRequest as excp:
+                if excp.message in harmless_errors:
+                    counts["skipped"] += 1
+                else:
+                    fatal.append(excp.message)
+            except TelegramError:
+                counts["failed"] += 1
+            else:
+                counts["done"] += 1
+
+    def targets(chat_ids):
+        # Check if this group has disabled gbans, or has gotten rid of us
+        return [chat_id for chat_id in chat_ids if sql.does_chat_gban(chat_id) and not is_chat_dead(chat_id)]
+
+    # the chats we've seen them in are where it matters, so those go first; the sweep catches the ones we missed
+    member_chats = set(await asyncio.to_thread(get_user_chat_ids, user_id))
+    await asyncio.gather(*(act_in(chat_id) for chat_id in targets(member_chats)))
+    if not fatal:
+        await report("{} done in the {} chats user {} is known to be in; sweeping the rest.".format(
+            action, len(member_chats), user_id))
+
+    cursor = ""
+    while not fatal:
+        chat_ids = await asyncio.to_thread(get_live_chat_ids_after, cursor, GBAN_SWEEP_BATCH_SIZE)
+        if not chat_ids:
+            break
+
+        # a sudo may have reversed this while it was running; the newer action runs its own fanout
+        if sql.is_user_gbanned(user_id) != (action == "gban"):
+            await report("{} of user {} stopped, as it was reversed in the meantime: {done} chats done, {skipped} "
+                         "skipped, {failed} failed.".format(action, user_id, **counts))
+            return
+
+        cursor = chat_ids[-1]
+        await asyncio.gather(*(act_in(chat_id) for chat_id in targets(chat_ids) if chat_id not in member_chats))
+
+        if time.monotonic() - last_report >= GBAN_REPORT_INTERVAL:
+            last_report = time.monotonic()
+            await report("{} of user {} in progress: {done} chats done, {skipped} skipped, {failed} failed "
+                         "so far.".format(action, user_id, **counts))
+
+    if fatal:
+        if action == "gban":
+            await asyncio.to_thread(sql.ungban_user, user_id)
+        await report("Could not {} user {} due to: {}".format(action, user_id, fatal[0]))
+        return
+
+    await report("{} complete! {done} chats done, {skipped} skipped, {failed} failed.".format(action, **counts))
+
 
 @run_async
 def gban(bot: Bot, update: Update, args: List[str]):
@@ -102,30 +200,9 @@ def gban(bot: Bot, update: Update, args: List[str]):
                  html=True)
 
     sql.gban_user(user_id, user_chat.username or user_chat.first_name, reason)
+    job_queue.run_once(run_fanout, 0, data=("gban", user_id))
 
-    chats = get_all_chats()
-    for chat in chats:
-        chat_id = chat.chat_id
-
-        # Check if this group has disabled gbans
-        if not sql.does_chat_gban(chat_id):
-            continue
-
-        try:
-            bot.kick_chat_member(chat_id, user_id)
-        except BadRequest as excp:
-            if excp.message in GBAN_ERRORS:
-                pass
-            else:
-                message.reply_text("Could not gban due to: {}".format(excp.message))
-                send_to_list(bot, SUDO_USERS + SUPPORT_USERS, "Could not gban due to: {}".format(excp.message))
-                sql.ungban_user(user_id)
-                return
-        except TelegramError:
-            pass
-
-    send_to_list(bot, SUDO_USERS + SUPPORT_USERS, "gban complete!")
-    message.reply_text("Person has been gbanned.")
+    message.reply_text("Person has been gbanned. I'll let the sudo list know how the kicks go.")
 
 
 @run_async
@@ -155,34 +232,140 @@ def ungban(bot: Bot, update: Update, args: List[str]):
                                                    mention_html(user_chat.id, user_chat.first_name)),
                  html=True)
 
-    chats = get_all_chats()
-    for chat in chats:
-        chat_id = chat.chat_id
+    # drop them first, so enforcement doesn't kick them again from chats we've already unbanned them in
+    sql.ungban_user(user_id)
+    job_queue.run_once(run_fanout, 0, data=("un-gban", user_id))
 
-        # Check if this group has disabled gbans
-        if not sql.does_chat_gban(chat_id):
-            continue
+    message.reply_text("Person has been un-gbanned. I'll let the sudo list know how the unbans go.")
 
-        try:
-            member = bot.get_chat_member(chat_id, user_id)
-            if member.status == 'kicked':
-                bot.unban_chat_member(chat_id, user_id)
 
-        except BadRequest as excp:
-            if excp.message in UNGBAN_ERRORS:
-                pass
+def parse_ban_list(file: BytesIO) -> Iterator[Tuple[int, Optional[str], Optional[str]]]:
+    """
+    Read an external ban list, one entry at a time.
+
+    Accepts a JSON array, JSON lines, or CSV rows of user_id[,name[,reason]]; JSON entries can be bare ids or objects
+    with user_id, name and reason keys. Rows without a valid user id, like CSV headers, are skipped.
+
+    Args:
+        file: The uploaded document.
+
+    Returns:
+        An iterator of (user_id, name, reason) tuples.
+    """
+    text = TextIOWrapper(file, encoding="utf-8", errors="replace")
+    first = text.read(1)
+    while first.isspace():
+        first = text.read(1)
+
+    if first == "[":
+        # a JSON array has to be parsed in one go
+        entries = json.loads(first + text.read())
+    elif first == "{":
+        entries = (json.loads(line) for line in chain([first + text.readline()], text) if line.strip())
+    else:
+        entries = csv.reader(chain([first + text.readline()], text))
+
+    for entry in entries:
+        if isinstance(entry, dict):
+            user_id, name, reason = entry.get("user_id"), entry.get("name"), entry.get("reason")
+        elif isinstance(entry, list):
+            user_id, name, reason = (entry + [None, None])[:3]
+        else:
+            user_id, name, reason = entry, None, None
+
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            continue
+        yield user_id, name or None, reason or None
+
+
+async def run_import_kicks(context):
+    user_ids = context.job.data
+    bot = context.bot
+    slots = asyncio.Semaphore(GBAN_CONCURRENCY)
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+    last_report = time.monotonic()
+
+    async def kick(chat_id, user_id):
+        async with slots:
+            try:
+                await gban_in_chat(bot, chat_id, user_id, PRIORITY_BULK)
+            except BadRequest as excp:
+                counts["skipped" if excp.message in GBAN_ERRORS else "failed"] += 1
+            except TelegramError:
+                counts["failed"] += 1
             else:
-                message.reply_text("Could not un-gban due to: {}".format(excp.message))
-                bot.send_message(OWNER_ID, "Could not un-gban due to: {}".format(excp.message))
-                return
-        except TelegramError:
-            pass
+                counts["done"] += 1
 
-    sql.ungban_user(user_id)
+    # Only chats we've seen them in get a kick - sweeping every chat for every imported user would take days.
+    # Enforcement catches them anywhere else as soon as they speak or join.
+    for start in range(0, len(user_ids), GBAN_IMPORT_BATCH_SIZE):
+        memberships = await asyncio.to_thread(get_memberships, user_ids[start:start + GBAN_IMPORT_BATCH_SIZE])
+        await asyncio.gather(*(kick(chat_id, user_id) for chat_id, user_id in memberships
+                               if sql.does_chat_gban(chat_id) and not is_chat_dead(chat_id)))
+
+        if time.monotonic() - last_report >= GBAN_REPORT_INTERVAL:
+            last_report = time.monotonic()
+            await asyncio.to_thread(send_to_list, bot, SUDO_USERS + SUPPORT_USERS,
+                                    "gban import: {} of {} users processed; {done} kicks, {skipped} skipped, "
+                                    "{failed} failed so far.".format(min(start + GBAN_IMPORT_BATCH_SIZE,
+                                                                         len(user_ids)), len(user_ids), **counts))
+
+    await asyncio.to_thread(send_to_list, bot, SUDO_USERS + SUPPORT_USERS,
+                            "gban import complete! {done} kicks, {skipped} skipped, {failed} failed.".format(**counts))
+
+
+@run_async
+def gban_import(bot: Bot, update: Update):
+    message = update.effective_message  # type: Optional[Message]
+    if not message.reply_to_message or not message.reply_to_message.document:
+        message.reply_text("Reply to a CSV or JSON ban list to import it.")
+        return
+
+    try:
+        file_info = bot.get_file(message.reply_to_message.document.file_id)
+    except BadRequest:
+        message.reply_text("Try downloading and reuploading the file as yourself before importing - this one seems "
+                           "to be iffy!")
+        return
 
-    send_to_list(bot, SUDO_USERS + SUPPORT_USERS, "un-gban complete!")
+    protected = set(SUDO_USERS + SUPPORT_USERS + [bot.id])
+    with BytesIO() as file:
+        file_info.download(out=file)
+        file.seek(0)
+        try:
+            # read the whole list before gbanning anyone, so that a bad line halfway through doesn't leave the first
+            # half gbanned but never reported or kicked
+            entries = [entry for entry in parse_ban_list(file) if entry[0] not in protected]
+        except (ValueError, csv.Error):
+            message.reply_text("I couldn't read that file - is it valid CSV or JSON?")
+            return
 
-    message.reply_text("Person has been un-gbanned.")
+    try:
+        added = sql.bulk_gban_users(entries)
+        failed = False
+    except sql.BulkGbanError as excp:
+        # the batches committed before the failure are gbanned all the same - report and kick exactly those
+        LOGGER.exception("Ban list import failed after %d new gbans", len(excp.added))
+        added = excp.added
+        failed = True
+
+    banner = update.effective_user  # type: Optional[User]
+    send_to_list(bot, SUDO_USERS + SUPPORT_USERS,
+                 "{} has imported a ban list, gbanning {} new users.{}".format(
+                     mention_html(banner.id, banner.first_name), len(added),
+                     " The import failed partway through; the rest of the list wasn't gbanned." if failed else ""),
+                 html=True)
+
+    if added:
+        job_queue.run_once(run_import_kicks, 0, data=added)
+    if failed:
+        message.reply_text("Something went wrong partway through the import - only {} new gbans made it in. Kicking "
+                           "them will take a while; I'll let the sudo list know how it goes.".format(len(added)))
+    else:
+        message.reply_text("Imported {} new gbans. Kicking them from the chats they're in will take a while; "
+                           "I'll let the sudo list know how it goes.".format(len(added)))
 
 
 @run_async
@@ -215,12 +398,13 @@ def check_and_ban(update, user_id, should_message=True):
 @run_async
 def enforce_gban(bot: Bot, update: Update):
     # Not using @restrict handler to avoid spamming - just ignore if cant gban.
-    if sql.does_chat_gban(update.effective_chat.id) and update.effective_chat.get_member(bot.id).can_restrict_members:
-        user = update.effective_user  # type: Optional[User]
-        chat = update.effective_chat  # type: Optional[Chat]
-        msg = update.effective_message  # type: Optional[Message]
+    ctx = get_update_context(update)
+    if sql.does_chat_gban(ctx.chat.id) and ctx.bot_can(bot.id, "can_restrict_members"):
+        user = ctx.user  # type: Optional[User]
+        chat = ctx.chat  # type: Optional[Chat]
+        msg = ctx.message  # type: Optional[Message]
 
-        if user and not is_user_admin(chat, user.id):
+        if user and not ctx.sender_is_admin():
             check_and_ban(update, user.id)
 
         if msg.new_chat_members:
@@ -230,7 +414,7 @@ def enforce_gban(bot: Bot, update: Update):
 
         if msg.reply_to_message:
             user = msg.reply_to_message.from_user  # type: Optional[User]
-            if user and not is_user_admin(chat, user.id):
+            if user and not is_user_admin_sync(chat, user.id):
                 check_and_ban(update, user.id, should_message=False)
 
 
@@ -296,6 +480,7 @@ GBAN_HANDLER = CommandHandler("gban", gban, pass_args=True,
                               filters=CustomFilters.sudo_filter | CustomFilters.support_filter)
 UNGBAN_HANDLER = CommandHandler("ungban", ungban, pass_args=True,
                                 filters=CustomFilters.sudo_filter | CustomFilters.support_filter)
+GBAN_IMPORT_HANDLER = CommandHandler("gbanimport", gban_import, filters=CustomFilters.sudo_filter)
 GBAN_LIST = CommandHandler("gbanlist", gbanlist,
                            filters=CustomFilters.sudo_filter | CustomFilters.support_filter)
 
@@ -305,6 +490,7 @@ GBAN_ENFORCER = MessageHandler(Filters.all & Filters.group, enforce_gban)
 
 dispatcher.add_handler(GBAN_HANDLER)
 dispatcher.add_handler(UNGBAN_HANDLER)
+dispatcher.add_handler(GBAN_IMPORT_HANDLER)
 dispatcher.add_handler(GBAN_LIST)
 dispatcher.add_handler(GBAN_STATUS)
 
@@ -0,0 +1,73 @@
+import threading
+from typing import Dict
+
+# Moderation features a chat may have configured. The sql modules keep these bits up to date on every write, so the
+# dispatcher can tell which handler groups have nothing to do in a chat without looking at their settings.
+FEATURE_BITS = {
+    "blacklist": 1 << 0,
+    "filters": 1 << 1,
+    "warn_filters": 1 << 2,
+    "locks": 1 << 3,
+    "restrictions": 1 << 4,
+    "antiflood": 1 << 5,
+}
+
+FEATURES_LOCK = threading.RLock()
+
+# chat_id -> bitmask of configured features. Chats without any have no entry.
+CHAT_FEATURES = {}  # type: Dict[str, int]
+
+# handler group -> features, at least one of which must be configured for the group to have anything to do.
+GROUP_FEATURES = {}  # type: Dict[int, int]
+
+
+def set_chat_feature(chat_id, feature: str, enabled: bool) -> None:
+    """
+    Record whether a chat has a feature configured.
+
+    Args:
+        chat_id: The chat to update.
+        feature: One of the FEATURE_BITS names.
+        enabled: Whether the chat now has that feature configured.
+    """
+    bit = FEATURE_BITS[feature]
+    with FEATURES_LOCK:
+        mask = CHAT_FEATURES.get(str(chat_id), 0)
+        mask = mask | bit if enabled else mask & ~bit
+        if mask:
+            CHAT_FEATURES[str(chat_id)] = mask
+        else:
+            CHAT_FEATURES.pop(str(chat_id), None)
+
+
+def get_chat_features(chat_id) -> int:
+    return CHAT_FEATURES.get(str(chat_id), 0)
+
+
+def register_group_feature(group: int, *features: str) -> None:
+    """
+    Mark a handler group as only being useful in chats that have one of the given features configured.
+
+    Args:
+        group: The handler group.
+        *features: FEATURE_BITS names.
+    """
+    for feature in features:
+        GROUP_FEATURES[group] = GROUP_FEATURES.get(group, 0) | FEATURE_BITS[feature]
+
+
+def group_can_act(group: int, chat_id) -> bool:
+    """
+    Check whether a handler group could do anything in a chat.
+
+    Args:
+        group: The handler group.
+        chat_id: The chat the update came from, or None.
+
+    Returns:
+        False only if the group is tied to features that the chat hasn't configured.
+    """
+    needed = GROUP_FEATURES.get(group)
+    if not needed or chat_id is None:
+        return True
+    return bool(CHAT_FEATURES.get(str(chat_id), 0) & needed)
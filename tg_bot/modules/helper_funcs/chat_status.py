@@ -1,37 +1,218 @@
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
-from typing import Optional, Callable, Coroutine, Any
+from typing import Optional, Callable, Coroutine, Any, Dict, Tuple
 
 from telegram import User, Chat, ChatMember, Update, Bot
 from telegram.error import BadRequest
 
-from tg_bot import DEL_CMDS, SUDO_USERS, WHITELIST_USERS
+from tg_bot import DEL_CMDS, SUDO_USERS, WHITELIST_USERS, LOGGER
+from tg_bot.modules.helper_funcs.outbound import OUTBOUND, PRIORITY_MODERATION
 
 
 # In PTB 20, the Bot class is passed directly, and Application instance is not used in these functions.
 # The need to get bot instance using get_bot() is removed.
 
-async def can_delete(chat: Chat, bot_id: int) -> bool:
-    """Check if the bot can delete messages in the given chat.
+# How long a chat's admin list is trusted before it is fetched again, in seconds.
+ADMIN_CACHE_TTL = 10 * 60
+# Maximum number of chats kept in the admin cache; the least recently used chat is evicted first.
+ADMIN_CACHE_SIZE = 4096
+
+# chat_id -> (expiry timestamp, {user_id: ChatMember})
+ADMIN_CACHE = OrderedDict()  # type: OrderedDict[int, Tuple[float, Dict[int, ChatMember]]]
+
+# Guards ADMIN_CACHE and BOT_MEMBER_CACHE: the event loop reads them while legacy handlers update them from worker
+# threads, and an entry popped between a get and a move_to_end would otherwise raise KeyError.
+CACHE_LOCK = threading.RLock()
+
+
+def _cache_get(cache: OrderedDict, chat_id: int):
+    """Return the cached value for a chat if it hasn't expired, marking it as recently used."""
+    with CACHE_LOCK:
+        cached = cache.get(chat_id)
+        if cached and cached[0] > time.monotonic():
+            cache.move_to_end(chat_id)
+            return cached[1]
+    return None
+
+
+def _cache_put(cache: OrderedDict, chat_id: int, ttl: float, value) -> None:
+    with CACHE_LOCK:
+        cache[chat_id] = (time.monotonic() + ttl, value)
+        cache.move_to_end(chat_id)
+        while len(cache) > ADMIN_CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+async def get_chat_admins(chat: Chat) -> Dict[int, ChatMember]:
+    """Get the administrators of a chat, from the cache when possible.
+
+    A single getChatAdministrators call fills the cache for the whole chat, so every admin check in that chat is
+    answered from memory until the entry expires or is invalidated.
+
+    Args:
+        chat: The Telegram chat.
+
+    Returns:
+        A dict of user ID to ChatMember, for every administrator (and the creator) of the chat.
+    """
+    admins = _cache_get(ADMIN_CACHE, chat.id)
+    if admins is not None:
+        return admins
+
+    admins = {member.user.id: member for member in await chat.get_administrators()}
+    _cache_put(ADMIN_CACHE, chat.id, ADMIN_CACHE_TTL, admins)
+    return admins
+
+
+def get_chat_admins_sync(chat: Chat) -> Dict[int, ChatMember]:
+    """Same as get_chat_admins, for sync handlers running in worker threads.
+
+    A cached admin list is read straight from memory; only a missing or expired one costs a getChatAdministrators
+    call, which is run on the event loop and waited for.
+
+    Args:
+        chat: The Telegram chat.
+
+    Returns:
+        A dict of user ID to ChatMember, for every administrator (and the creator) of the chat.
+    """
+    admins = _cache_get(ADMIN_CACHE, chat.id)
+    if admins is not None:
+        return admins
+
+    members = OUTBOUND.call_threadsafe(None, PRIORITY_MODERATION, chat.get_administrators)
+    admins = {member.user.id: member for member in members}
+    _cache_put(ADMIN_CACHE, chat.id, ADMIN_CACHE_TTL, admins)
+    return admins
+
+
+def invalidate_admin_cache(chat_id: int) -> None:
+    """Forget the cached admin list of a chat, eg after a promotion, demotion or chat_member update.
+
+    Args:
+        chat_id: The ID of the chat.
+    """
+    with CACHE_LOCK:
+        ADMIN_CACHE.pop(int(chat_id), None)
+
+
+# How long the bot's own rights in a chat are trusted without a my_chat_member update, in seconds.
+BOT_MEMBER_CACHE_TTL = 30 * 60
+
+# chat_id -> (expiry timestamp, the bot's ChatMember)
+BOT_MEMBER_CACHE = OrderedDict()  # type: OrderedDict[int, Tuple[float, ChatMember]]
+
+
+async def get_bot_member(chat: Chat, bot_id: int) -> ChatMember:
+    """Get the bot's own ChatMember in a chat, from the rights snapshot when possible.
+
+    The snapshot is replaced by my_chat_member updates as soon as the bot's rights change, and only falls back to a
+    getChatMember call once it is older than BOT_MEMBER_CACHE_TTL.
 
     Args:
         chat: The Telegram chat.
         bot_id: The ID of the bot.
 
     Returns:
-        True if the bot can delete messages, False otherwise.
+        The bot's ChatMember in that chat.
+    """
+    member = _cache_get(BOT_MEMBER_CACHE, chat.id)
+    if member is not None:
+        return member
+
+    member = await chat.get_member(bot_id)
+    set_bot_member(chat.id, member)
+    return member
+
+
+def get_bot_member_sync(chat: Chat, bot_id: int) -> ChatMember:
+    """Same as get_bot_member, for sync handlers running in worker threads.
+
+    The snapshot is read straight from memory; only a missing or expired one costs a getChatMember call, which is
+    run on the event loop and waited for.
+
+    Args:
+        chat: The Telegram chat.
+        bot_id: The ID of the bot.
+
+    Returns:
+        The bot's ChatMember in that chat.
+    """
+    member = _cache_get(BOT_MEMBER_CACHE, chat.id)
+    if member is not None:
+        return member
+
+    member = OUTBOUND.call_threadsafe(None, PRIORITY_MODERATION, chat.get_member, bot_id)
+    set_bot_member(chat.id, member)
+    return member
+
+
+def set_bot_member(chat_id: int, member: ChatMember) -> None:
+    """Store a fresh snapshot of the bot's rights in a chat, eg from a my_chat_member update.
+
+    Args:
+        chat_id: The ID of the chat.
+        member: The bot's new ChatMember.
+    """
+    _cache_put(BOT_MEMBER_CACHE, int(chat_id), BOT_MEMBER_CACHE_TTL, member)
+
+
+async def bot_has_right(chat: Chat, bot_id: int, right: str) -> bool:
+    """Check one of the bot's admin rights in a chat, eg "can_restrict_members".
+
+    Args:
+        chat: The Telegram chat.
+        bot_id: The ID of the bot.
+        right: The ChatMember attribute to check.
+
+    Returns:
+        True if the bot has that right, False otherwise.
     """
     try:
-        member = await chat.get_member(bot_id)  # Await the coroutine
-        return member.can_delete_messages
+        member = await get_bot_member(chat, bot_id)
+        return bool(getattr(member, right, False))
     except BadRequest:
-        # Handle the specific exception if the bot isn't in the chat or other issues.
-        return False  # Or raise, depending on desired behavior
+        return False
     except Exception as e:
-        # Log other errors
-        print(f"Error in can_delete: {e}")
+        print(f"Error in bot_has_right: {e}")
         return False
 
 
+def bot_has_right_sync(chat: Chat, bot_id: int, right: str) -> bool:
+    """Same as bot_has_right, for sync handlers running in worker threads.
+
+    Args:
+        chat: The Telegram chat.
+        bot_id: The ID of the bot.
+        right: The ChatMember attribute to check.
+
+    Returns:
+        True if the bot has that right, False otherwise.
+    """
+    try:
+        return bool(getattr(get_bot_member_sync(chat, bot_id), right, False))
+    except BadRequest:
+        return False
+    except Exception:
+        LOGGER.exception("Couldn't check the bot's %s right in chat %s", right, chat.id)
+        return False
+
+
+async def can_delete(chat: Chat, bot_id: int) -> bool:
+    """Check if the bot can delete messages in the given chat.
+
+    Args:
+        chat: The Telegram chat.
+        bot_id: The ID of the bot.
+
+    Returns:
+        True if the bot can delete messages, False otherwise.
+    """
+    return await bot_has_right(chat, bot_id, "can_delete_messages")
+
+
 
 async def is_user_ban_protected(chat: Chat, user_id: int, member: ChatMember = None) -> bool:
     """Check if a user is protected from being banned.
@@ -54,7 +235,7 @@ async def is_user_ban_protected(chat: Chat, user_id: int, member: ChatMember = N
 
     if not member:
         try:
-            member = await chat.get_member(user_id)  # Await
+            return user_id in await get_chat_admins(chat)
         except BadRequest:
             return False  # Or raise
         except Exception as e:
@@ -84,7 +265,7 @@ async def is_user_admin(chat: Chat, user_id: int, member: ChatMember = None) ->
 
     if not member:
         try:
-            member = await chat.get_member(user_id) # Await
+            return user_id in await get_chat_admins(chat)
         except BadRequest:
             return False # Or raise
         except Exception as e:
@@ -94,6 +275,35 @@ async def is_user_admin(chat: Chat, user_id: int, member: ChatMember = None) ->
 
 
 
+def is_user_admin_sync(chat: Chat, user_id: int, member: ChatMember = None) -> bool:
+    """Same as is_user_admin, for sync handlers running in worker threads.
+
+    Args:
+        chat: The Telegram chat.
+        user_id: The ID of the user.
+        member: Optional ChatMember object. If provided, avoids an API call.
+
+    Returns:
+        True if the user is an admin, False otherwise.
+    """
+    if (
+        chat.type == "private"
+        or user_id in SUDO_USERS
+        or chat.all_members_are_administrators
+    ):
+        return True
+
+    if not member:
+        try:
+            return user_id in get_chat_admins_sync(chat)
+        except BadRequest:
+            return False
+        except Exception:
+            LOGGER.exception("Couldn't check whether user %s is an admin of chat %s", user_id, chat.id)
+            return False
+    return member.status in ("administrator", "creator")
+
+
 async def is_bot_admin(chat: Chat, bot_id: int, bot_member: ChatMember = None) -> bool:
     """Check if the bot is an admin in the given chat.
 
@@ -110,7 +320,7 @@ async def is_bot_admin(chat: Chat, bot_id: int, bot_member: ChatMember = None) -
 
     if not bot_member:
         try:
-            bot_member = await chat.get_member(bot_id) # Await
+            return bot_id in await get_chat_admins(chat)
         except BadRequest:
             return False
         except Exception as e:
@@ -179,7 +389,7 @@ def can_pin(func: Callable[..., Coroutine[Any, Any, Any]]) -> Callable[..., Coro
     @wraps(func)
     async def pin_rights(bot: Bot, update: Update, *args, **kwargs) -> Any:
         try:
-            member = await update.effective_chat.get_member(bot.id) # Await
+            member = await get_bot_member(update.effective_chat, bot.id)
             if member.can_pin_messages:
                 return await func(bot, update, *args, **kwargs) # Await
             else:
@@ -211,7 +421,7 @@ def can_promote(func: Callable[..., Coroutine[Any, Any, Any]]) -> Callable[...,
     @wraps(func)
     async def promote_rights(bot: Bot, update: Update, *args, **kwargs) -> Any:
         try:
-            member = await update.effective_chat.get_member(bot.id) # Await
+            member = await get_bot_member(update.effective_chat, bot.id)
             if member.can_promote_members:
                 return await func(bot, update, *args, **kwargs) #Await
             else:
@@ -243,7 +453,7 @@ def can_restrict(func: Callable[..., Coroutine[Any, Any, Any]]) -> Callable[...,
     @wraps(func)
     async def restrict_rights(bot: Bot, update: Update, *args, **kwargs) -> Any:
         try:
-            member = await update.effective_chat.get_member(bot.id) #Await
+            member = await get_bot_member(update.effective_chat, bot.id)
             if member.can_restrict_members:
                 return await func(bot, update, *args, **kwargs) #Await
             else:
@@ -5,10 +5,41 @@ from telegram import Message, MessageEntity, User
 from telegram.error import BadRequest
 from telegram.ext import CallbackContext
 
-from tg_bot import LOGGER  # Assuming this is your logger
-from tg_bot.modules.users import get_user_id # Assuming this is your user id getter
+import tg_bot.modules.sql.users_sql as sql
+from tg_bot import LOGGER, dispatcher
 
 
+def get_user_id(username):
+    # ensure valid userid
+    if len(username) <= 5:
+        return None
+
+    if username.startswith('@'):
+        username = username[1:]
+
+    users = sql.get_userid_by_name(username)
+
+    if not users:
+        return None
+
+    elif len(users) == 1:
+        return users[0].user_id
+
+    else:
+        for user_obj in users:
+            try:
+                userdat = dispatcher.bot.get_chat(user_obj.user_id)
+                if userdat.username == username:
+                    return userdat.id
+
+            except BadRequest as excp:
+                if excp.message == 'Chat not found':
+                    pass
+                else:
+                    LOGGER.exception("Error extracting user ID")
+
+    return None
+
 
 def id_from_reply(message: Message) -> Tuple[Optional[int], Optional[str]]:
     """
@@ -0,0 +1,8 @@
+from feed_fetch import FeedFetcher
+from tg_bot import LOGGER
+from tg_bot.modules.helper_funcs.feed_parser import MAX_FEED_BYTES
+
+FETCH_CONCURRENCY = 10
+FETCH_TIMEOUT = 20
+
+FEED_FETCHER = FeedFetcher(FETCH_CONCURRENCY, FETCH_TIMEOUT, MAX_FEED_BYTES, LOGGER)
@@ -0,0 +1,103 @@
+import atexit
+import multiprocessing
+import threading
+from multiprocessing import TimeoutError
+from typing import Any, Dict, Optional
+
+from feed_worker import parse_feed
+from tg_bot import LOGGER
+
+# Feeds bigger than this aren't downloaded past the limit, let alone parsed.
+MAX_FEED_BYTES = 2 * 1024 * 1024
+# Only the newest entries are kept; nothing ever sends more than a handful of them.
+MAX_FEED_ENTRIES = 50
+PARSE_TIMEOUT = 10
+PARSE_WORKERS = 2
+# The bot runs many threads, which a forked child would inherit in whatever state they were in (held locks
+# included), so workers are started from a clean process instead.
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class FeedParser(object):
+    """
+    Parses feeds in a pool of worker processes, so that a huge or pathological feed can't hold up the bot.
+
+    At most one parse per worker is handed to the pool at a time, so the timeout only covers the parse itself, not
+    time spent queued behind others. A parse that runs past the timeout can't be cancelled on its own, so the whole
+    pool is replaced; anything else it was parsing at the time fails too, and is retried on that feed's next poll.
+    """
+
+    def __init__(self, workers: int, timeout: float, max_bytes: int, max_entries: int):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._pool = None  # type: Optional[multiprocessing.pool.Pool]
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers)
+
+        self.parsed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                context = multiprocessing.get_context(START_METHOD)
+                if START_METHOD == "forkserver":
+                    context.set_forkserver_preload(["feed_worker"])
+                self._pool = context.Pool(self.workers)
+            return self._pool
+
+    def _reset_pool(self, pool) -> None:
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.terminate()
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.terminate()
+
+    def parse(self, data: bytes) -> Optional[Dict[str, Any]]:
+        """
+        Parse a feed. Blocks until it's done, so call it from a worker thread; up to `workers` threads can parse at
+        once.
+
+        Args:
+            data: The raw feed.
+
+        Returns:
+            A dict with the feed's bozo flag, title, link, description, the newest entry's description and a list of
+            entries (title, link and guid, newest first); or None if the feed was too big, too slow to parse, or broke
+            the parser.
+        """
+        if len(data) > self.max_bytes:
+            self.rejected += 1
+            return None
+
+        with self._slots:
+            pool = self._get_pool()
+            try:
+                result = pool.apply_async(parse_feed, (data, self.max_entries)).get(self.timeout)
+            except TimeoutError:
+                LOGGER.warning("Feed parsing took over %ss; restarting the parser pool.", self.timeout)
+                self.timed_out += 1
+                self._reset_pool(pool)
+                return None
+            except Exception:
+                LOGGER.exception("Feed parsing failed.")
+                self.rejected += 1
+                return None
+
+        self.parsed += 1
+        return result
+
+    def __stats__(self) -> str:
+        return "RSS parses: {} done, {} rejected, {} timed out.".format(self.parsed, self.rejected, self.timed_out)
+
+
+FEED_PARSER = FeedParser(PARSE_WORKERS, PARSE_TIMEOUT, MAX_FEED_BYTES, MAX_FEED_ENTRIES)
+atexit.register(FEED_PARSER.close)
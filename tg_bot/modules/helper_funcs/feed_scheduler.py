@@ -0,0 +1,105 @@
+import heapq
+import random
+import time
+from typing import Dict, Iterable, List, Tuple
+
+# The old fixed poll interval is still the fastest a feed gets polled, so busy feeds see no extra delay.
+MIN_INTERVAL = 60
+# Quiet feeds back off to this; a feed that posts weekly doesn't need checking every minute.
+MAX_INTERVAL = 60 * 60
+# Feeds that keep failing back off further still.
+MAX_FAILURE_INTERVAL = 6 * 60 * 60
+QUIET_BACKOFF = 1.5
+# Each poll lands somewhere in interval * (1 +/- JITTER), so feeds added together drift apart.
+JITTER = 0.1
+
+
+class FeedState(object):
+    def __init__(self, due: float):
+        self.due = due
+        self.interval = MIN_INTERVAL
+        self.failures = 0
+
+
+class FeedScheduler(object):
+    """
+    Decides when each feed is polled next, with a heap of due times.
+
+    Feeds which had new entries are polled more often, down to MIN_INTERVAL. Feeds which didn't back off towards
+    MAX_INTERVAL, and feeds which failed to fetch back off exponentially towards MAX_FAILURE_INTERVAL.
+    """
+
+    def __init__(self):
+        self._heap = []  # type: List[Tuple[float, str]]
+        self._feeds = {}  # type: Dict[str, FeedState]
+
+    def sync(self, feed_links: Iterable[str]) -> None:
+        """
+        Start tracking new feeds, and forget the ones nobody subscribes to any more. New feeds are first polled at a
+        random point within MIN_INTERVAL, so that a restart doesn't poll every feed in the same tick.
+
+        Args:
+            feed_links: Every feed that currently has subscribers.
+        """
+        now = time.monotonic()
+        feed_links = set(feed_links)
+        for feed_link in feed_links - self._feeds.keys():
+            due = now + random.uniform(0, MIN_INTERVAL)
+            self._feeds[feed_link] = FeedState(due)
+            heapq.heappush(self._heap, (due, feed_link))
+        # heap entries for dropped feeds are skipped when they come up
+        for feed_link in self._feeds.keys() - feed_links:
+            del self._feeds[feed_link]
+
+    def pop_due(self) -> List[str]:
+        """Return the feeds whose poll is due. They aren't scheduled again until reschedule is called for them."""
+        now = time.monotonic()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, feed_link = heapq.heappop(self._heap)
+            state = self._feeds.get(feed_link)
+            if state is None or state.due != when:  # unsubscribed, or a stale entry
+                continue
+            due.append(feed_link)
+        return due
+
+    def reschedule(self, feed_link: str, fresh: bool = False, failed: bool = False) -> None:
+        """
+        Schedule the next poll of a feed, based on how the last one went.
+
+        Args:
+            feed_link: The feed that was just polled.
+            fresh: Whether the poll found new entries.
+            failed: Whether the feed couldn't be fetched or parsed.
+        """
+        state = self._feeds.get(feed_link)
+        if state is None:
+            return
+
+        if failed:
+            state.failures += 1
+            interval = min(MAX_FAILURE_INTERVAL, state.interval * 2 ** state.failures)
+        else:
+            state.failures = 0
+            if fresh:
+                state.interval = max(MIN_INTERVAL, state.interval / 2)
+            else:
+                state.interval = min(MAX_INTERVAL, state.interval * QUIET_BACKOFF)
+            interval = state.interval
+
+        state.due = time.monotonic() + interval * random.uniform(1 - JITTER, 1 + JITTER)
+        heapq.heappush(self._heap, (state.due, feed_link))
+
+    def __len__(self) -> int:
+        return len(self._feeds)
+
+    def __stats__(self) -> str:
+        if not self._feeds:
+            return "No RSS feeds scheduled."
+        average = sum(state.interval for state in self._feeds.values()) / len(self._feeds)
+        failing = sum(1 for state in self._feeds.values() if state.failures)
+        return "{} RSS feeds scheduled, polled every {:.0f}s on average; {} failing.".format(len(self._feeds),
+                                                                                           average, failing)
+
+
+FEED_SCHEDULE = FeedScheduler()
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from tg_bot import WORKERS
+
+
+class LegacyExecutor(object):
+    """
+    Runs old-style synchronous (bot, update) handlers in a dedicated, sized thread pool.
+
+    Ordering and backpressure are up to the caller: updates reach here through UPDATE_LANES, which already runs the
+    updates of a chat one at a time and caps how many chats are in flight.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="legacy-handler")
+        self._stats_lock = threading.Lock()
+
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Run a synchronous function in the pool.
+
+        Args:
+            func: The synchronous function to run.
+            *args: Positional arguments for func.
+            **kwargs: Keyword arguments for func.
+
+        Returns:
+            Whatever func returned.
+        """
+        queued_at = time.monotonic()
+        self.pending += 1
+
+        def call():
+            # runs on a pool thread, so the wait includes time spent queued behind busy workers
+            wait = time.monotonic() - queued_at
+            with self._stats_lock:
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                self.running += 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, call)
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get a snapshot of the pool's load.
+
+        Returns:
+            A dict with the current queue depth, running calls, completed calls, and average/max queue wait (seconds).
+        """
+        return {"queue_depth": self.pending - self.running,
+                "running": self.running,
+                "completed": self.completed,
+                "avg_wait": self.total_wait / self.completed if self.completed else 0.0,
+                "max_wait": self.max_wait}
+
+    def __stats__(self) -> str:
+        stats = self.stats()
+        return "Legacy handler pool ({} threads): {} queued, {} running, {} done; {:.0f}ms average wait " \
+               "(max {:.0f}ms).".format(self.workers, stats["queue_depth"], stats["running"], stats["completed"],
+                                        stats["avg_wait"] * 1000, stats["max_wait"] * 1000)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+
+LEGACY_EXECUTOR = LegacyExecutor(WORKERS)
+
+
+def is_legacy_callback(callback: Callable) -> bool:
+    """
+    Check whether a handler callback is an old-style synchronous one.
+
+    Args:
+        callback: The handler's callback.
+
+    Returns:
+        True if the callback has to go through the LegacyExecutor, False if it is a coroutine function.
+    """
+    return not asyncio.iscoroutinefunction(callback)
+
+
+async def run_legacy_handler(handler, update, context) -> Any:
+    """
+    Call an old-style (bot, update[, args]) handler callback through the LegacyExecutor.
+
+    Args:
+        handler: The handler whose callback should be run.
+        update: The incoming update.
+        context: The PTB 20 context for this update.
+
+    Returns:
+        Whatever the callback returned.
+    """
+    args = [context.bot, update]
+    if getattr(handler, "pass_args", False):
+        args.append(context.args or [])
+
+    return await LEGACY_EXECUTOR.run(handler.callback, *args)
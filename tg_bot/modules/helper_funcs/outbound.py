@@ -0,0 +1,233 @@
+import asyncio
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from telegram.error import RetryAfter
+
+from tg_bot import LOGGER
+
+# Priority classes - lower goes first. Moderation actions must never wait behind a cosmetic reply or a broadcast.
+PRIORITY_MODERATION = 0
+PRIORITY_REPLY = 1
+PRIORITY_BULK = 2
+
+PRIORITY_NAMES = {PRIORITY_MODERATION: "moderation", PRIORITY_REPLY: "reply", PRIORITY_BULK: "bulk"}
+
+# Telegram's documented limits: ~30 requests/second overall, ~1 message/second in a private chat and
+# 20 messages/minute in a group.
+GLOBAL_RATE = 30
+GLOBAL_BURST = 30
+PRIVATE_RATE = 1
+PRIVATE_BURST = 1
+GROUP_RATE = 20 / 60
+GROUP_BURST = 5
+
+OUTBOUND_WORKERS = 8
+# Bulk requests (broadcasts, RSS) are dropped rather than queued once this many requests are waiting.
+MAX_QUEUED_BULK = 10000
+# How often a request is retried after a RetryAfter before giving up on it.
+MAX_RETRIES = 3
+# Number of per-chat buckets kept around; the least recently used ones are forgotten first.
+CHAT_BUCKETS_SIZE = 10000
+
+
+class TokenBucket(object):
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # requests set aside until this bucket refills; each one gets its own later slot
+        self.waiting = 0
+
+    def delay(self) -> float:
+        """Seconds until a token is available - 0 if one can be taken right now."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        """Empty the bucket so that nothing is let through for the given number of seconds."""
+        self.delay()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    async def acquire(self) -> None:
+        delay = self.delay()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.delay()
+        self.take()
+
+
+class OutboundScheduler(object):
+    """
+    The single path for Telegram API calls that could trip the flood limits.
+
+    Requests are queued by priority class and sent by a few workers, each waiting for a token from the global bucket.
+    A request tied to a chat whose bucket is empty is set aside until the bucket refills, and the worker moves on to
+    the next request, so one busy chat can't hold up the others. RetryAfter errors pause the bucket that was hit and
+    requeue the request.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._queue = None  # type: Optional[asyncio.PriorityQueue]
+        self._loop = None  # type: Optional[asyncio.AbstractEventLoop]
+        self._loop_thread = None  # type: Optional[int]
+        self._counter = itertools.count()
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._chats = OrderedDict()  # type: OrderedDict[int, TokenBucket]
+
+        self.sent = {prio: 0 for prio in PRIORITY_NAMES}
+        self.retried = {prio: 0 for prio in PRIORITY_NAMES}
+        self.dropped = {prio: 0 for prio in PRIORITY_NAMES}
+        # requests waiting out their chat's limit, outside the queue
+        self.deferred = 0
+
+    def start(self) -> None:
+        """Start the workers on the running event loop. Does nothing if they are already running."""
+        if self._queue is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._queue = asyncio.PriorityQueue()
+        for _ in range(self.workers):
+            self._loop.create_task(self._work())
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(GROUP_RATE, GROUP_BURST)
+            else:
+                bucket = TokenBucket(PRIVATE_RATE, PRIVATE_BURST)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > CHAT_BUCKETS_SIZE:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def call(self, chat_id: Optional[int], priority: int, func: Callable, *args, **kwargs) -> Any:
+        """
+        Queue an API call and wait for its result.
+
+        Args:
+            chat_id: The chat the call sends a message to, so that the chat's own limit applies. Pass None for calls
+                that only count towards the global limit, like kicks and deletions.
+            priority: One of the PRIORITY_* classes.
+            func: The bot method to call.
+            *args: Positional arguments for func.
+            **kwargs: Keyword arguments for func.
+
+        Returns:
+            Whatever func returned, or None if the request was a bulk one and was dropped because the queue was full.
+        """
+        self.start()
+        if priority >= PRIORITY_BULK and self._queue.qsize() + self.deferred >= MAX_QUEUED_BULK:
+            self.dropped[priority] += 1
+            return None
+
+        future = self._loop.create_future()
+        self._queue.put_nowait((priority, next(self._counter), chat_id, func, args, kwargs, future, 0))
+        return await future
+
+    def call_threadsafe(self, chat_id: Optional[int], priority: int, func: Callable, *args, **kwargs) -> Any:
+        """
+        Blocking version of call, for synchronous handlers running in worker threads.
+
+        Calls made before the scheduler was started, or from the event loop's own thread (where blocking would
+        deadlock), are made directly instead.
+        """
+        if self._loop is None or threading.get_ident() == self._loop_thread:
+            return func(*args, **kwargs)
+        return asyncio.run_coroutine_threadsafe(self.call(chat_id, priority, func, *args, **kwargs),
+                                                self._loop).result()
+
+    def _defer(self, bucket: TokenBucket, delay: float, item: tuple) -> None:
+        """Put a request back in the queue once its chat has a token for it, keeping its priority and place in line."""
+        # requests already waiting on the same chat get the tokens before this one
+        delay += bucket.waiting / bucket.rate
+        bucket.waiting += 1
+        self.deferred += 1
+
+        def requeue():
+            bucket.waiting -= 1
+            self.deferred -= 1
+            self._queue.put_nowait(item)
+
+        self._loop.call_later(delay, requeue)
+
+    async def _work(self) -> None:
+        while True:
+            priority, seq, chat_id, func, args, kwargs, future, attempt = await self._queue.get()
+            try:
+                if future.done():  # caller went away
+                    continue
+
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+                if bucket is not None:
+                    delay = bucket.delay()
+                    if delay > 0:
+                        # never park a worker on one chat's limit - the other chats' requests would all wait behind it
+                        self._defer(bucket, delay, (priority, seq, chat_id, func, args, kwargs, future, attempt))
+                        continue
+                    bucket.take()
+                await self._global.acquire()
+
+                try:
+                    if asyncio.iscoroutinefunction(func):
+                        result = await func(*args, **kwargs)
+                    else:
+                        result = await asyncio.to_thread(func, *args, **kwargs)
+                except RetryAfter as excp:
+                    (bucket or self._global).pause(excp.retry_after)
+                    if attempt >= MAX_RETRIES:
+                        LOGGER.warning("Giving up on %s call for chat %s after %d RetryAfter errors.",
+                                       PRIORITY_NAMES[priority], chat_id, attempt + 1)
+                        self.dropped[priority] += 1
+                        if not future.done():
+                            future.set_exception(excp)
+                    else:
+                        self.retried[priority] += 1
+                        # keep its place in line: same priority and sequence number
+                        self._queue.put_nowait((priority, seq, chat_id, func, args, kwargs, future, attempt + 1))
+                except Exception as excp:
+                    if not future.done():
+                        future.set_exception(excp)
+                else:
+                    self.sent[priority] += 1
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as excp:
+                # a worker that dies takes its share of the queue with it - log, fail this request and carry on
+                LOGGER.exception("Unexpected error in the outbound worker, for a %s call to chat %s",
+                                 PRIORITY_NAMES[priority], chat_id)
+                if not future.done():
+                    future.set_exception(excp)
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"queued": self._queue.qsize() if self._queue else 0,
+                "deferred": self.deferred,
+                "sent": dict(self.sent),
+                "retried": dict(self.retried),
+                "dropped": dict(self.dropped)}
+
+    def __stats__(self) -> str:
+        return "Outbound API calls: {} queued, {} waiting on chat limits, {} sent, {} retried after flood waits, " \
+               "{} dropped.".format(self._queue.qsize() if self._queue else 0, self.deferred, sum(self.sent.values()),
+                                    sum(self.retried.values()), sum(self.dropped.values()))
+
+
+OUTBOUND = OutboundScheduler(OUTBOUND_WORKERS)
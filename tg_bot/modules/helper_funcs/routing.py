@@ -0,0 +1,134 @@
+from heapq import merge
+from typing import Dict, List, Optional, Tuple
+
+import telegram.ext as tg
+from telegram import Update
+
+from tg_bot.modules.helper_funcs.handlers import CMD_STARTERS
+
+MESSAGE_KINDS = ("message", "edited_message", "channel_post", "edited_channel_post")
+UPDATE_KINDS = MESSAGE_KINDS + ("callback_query", "other")
+
+# (group, registration position, handler) - sorting on the first two gives the order PTB would try them in.
+Entry = Tuple[int, int, object]
+
+
+def update_kind(update: Update) -> str:
+    for kind in MESSAGE_KINDS:
+        if getattr(update, kind, None):
+            return kind
+    if update.callback_query:
+        return "callback_query"
+    return "other"
+
+
+def parse_command(update: Update) -> Optional[str]:
+    """
+    Get the command an update starts with, parsed the same way the command handlers parse it.
+
+    Args:
+        update: The incoming update.
+
+    Returns:
+        The lowercased command name without its starter or @botname, or None if the update isn't a command.
+    """
+    message = update.effective_message
+    if not message or not message.text or len(message.text) < 2:
+        return None
+
+    fst_word = message.text.split(None, 1)[0]
+    if len(fst_word) < 2 or not fst_word.startswith(CMD_STARTERS):
+        return None
+    return fst_word[1:].split('@', 1)[0].lower()
+
+
+def _handler_commands(handler) -> Optional[List[str]]:
+    commands = getattr(handler, "commands", None) or getattr(handler, "command", None)
+    if not isinstance(handler, tg.CommandHandler) or not commands:
+        return None
+    if isinstance(commands, str):
+        commands = [commands]
+    return [command.lower() for command in commands]
+
+
+def _handler_kinds(handler) -> Tuple[str, ...]:
+    if isinstance(handler, (tg.CommandHandler, tg.MessageHandler)):
+        return MESSAGE_KINDS
+    if isinstance(handler, tg.CallbackQueryHandler):
+        return ("callback_query",)
+    # conversation handlers, inline queries, chat member updates, ... - offer them everything
+    return UPDATE_KINDS
+
+
+class HandlerIndex(object):
+    """
+    Maps an update's kind and command name to the handlers that could possibly match it.
+
+    Command handlers are only offered updates carrying one of their commands, and e.g. callback queries never reach
+    message handlers. Which handler actually runs is still decided by check_update, in the usual group order.
+    """
+
+    def __init__(self, handlers: Dict[int, List]):
+        self.signature = self.handler_signature(handlers)
+        self._generic = {kind: [] for kind in UPDATE_KINDS}  # type: Dict[str, List[Entry]]
+        self._commands = {kind: {} for kind in UPDATE_KINDS}  # type: Dict[str, Dict[str, List[Entry]]]
+        self._routes = {}  # type: Dict[Tuple[str, Optional[str]], List[Entry]]
+
+        for group in sorted(handlers):
+            for position, handler in enumerate(handlers[group]):
+                entry = (group, position, handler)
+                commands = _handler_commands(handler)
+                for kind in _handler_kinds(handler):
+                    if commands is None:
+                        self._generic[kind].append(entry)
+                    else:
+                        for command in commands:
+                            self._commands[kind].setdefault(command, []).append(entry)
+
+    @staticmethod
+    def handler_signature(handlers: Dict[int, List]) -> Tuple:
+        # The index keeps references to the handlers it was built from, so none of their ids can have been reused by a
+        # new handler while it's around - equal signatures mean the exact same handlers, in the same places.
+        return tuple((group, tuple(map(id, handlers[group]))) for group in sorted(handlers))
+
+    def candidates(self, update: Update) -> List[Entry]:
+        """
+        Get the handlers to offer an update to.
+
+        Args:
+            update: The incoming update.
+
+        Returns:
+            (group, position, handler) tuples in dispatch order.
+        """
+        kind = update_kind(update)
+        command = parse_command(update) if kind in MESSAGE_KINDS else None
+        key = (kind, command)
+
+        route = self._routes.get(key)
+        if route is None:
+            by_command = self._commands[kind].get(command, []) if command else []
+            route = list(merge(self._generic[kind], by_command, key=lambda entry: entry[:2]))
+            # only cache commands we know of, so random /garbage can't grow this forever
+            if not command or by_command:
+                self._routes[key] = route
+        return route
+
+
+_INDEX = None  # type: Optional[HandlerIndex]
+
+
+def get_handler_index(handlers: Dict[int, List]) -> HandlerIndex:
+    """
+    Get the routing index for the registered handlers, rebuilding it whenever handlers were added, removed or replaced.
+
+    Args:
+        handlers: The application's {group: [handlers]} dict.
+
+    Returns:
+        An up to date HandlerIndex.
+    """
+    global _INDEX
+    if _INDEX is None or _INDEX.signature != HandlerIndex.handler_signature(handlers):
+        _INDEX = HandlerIndex(handlers)
+    return _INDEX
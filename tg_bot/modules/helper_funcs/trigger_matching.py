@@ -0,0 +1,115 @@
+import re
+from typing import Dict, Iterable, List, Optional, Pattern
+
+# A trigger only counts when it isn't glued to other word characters - this is the same boundary rule as the old
+# per-keyword r"( |^|[^\w])" + keyword + r"( |$|[^\w])" patterns, just expressed as zero-width assertions.
+_BOUNDARY_START = r"(?<!\w)"
+_BOUNDARY_END = r"(?!\w)"
+
+
+def trigger_sort_key(trigger: str):
+    """Longest triggers first, then alphabetical - the priority order used by filters."""
+    return -len(trigger), trigger
+
+
+def _trie_to_regex(node: Dict) -> str:
+    """
+    Turn a character trie into a regex alternation, so that shared prefixes are only tested once.
+
+    Args:
+        node: The trie node to render. The empty-string key marks the end of a trigger.
+
+    Returns:
+        A regex fragment matching every trigger below this node.
+    """
+    end = "" in node
+    branches = []
+    for char in sorted(k for k in node if k):
+        branches.append(re.escape(char) + _trie_to_regex(node[char]))
+
+    if not branches:
+        return ""
+
+    if len(branches) == 1 and not end:
+        return branches[0]
+
+    result = "(?:" + "|".join(branches) + ")"
+    if end:
+        # optional groups are greedy, so the longer trigger is tried first
+        result += "?"
+    return result
+
+
+class TriggerMatcher(object):
+    """
+    A single compiled, case-folded pattern for a whole set of triggers.
+
+    Scanning a message costs one pass over the text, however many triggers the chat has.
+    """
+
+    def __init__(self, triggers: Iterable[str]):
+        self.triggers = sorted(set(triggers), key=trigger_sort_key)  # type: List[str]
+
+        # several triggers may fold to the same text; the highest priority one wins.
+        self._folded = {}  # type: Dict[str, str]
+        for trigger in self.triggers:
+            self._folded.setdefault(trigger.casefold(), trigger)
+
+        self._pattern = None  # type: Optional[Pattern]
+        self._overlapping = None  # type: Optional[Pattern]
+        if self._folded:
+            trie = {}  # type: Dict
+            for folded in self._folded:
+                node = trie
+                for char in folded:
+                    node = node.setdefault(char, {})
+                node[""] = True
+
+            body = _trie_to_regex(trie)
+            self._pattern = re.compile(_BOUNDARY_START + "(" + body + ")" + _BOUNDARY_END)
+            # zero-width variant, so that overlapping triggers are all seen.
+            self._overlapping = re.compile(_BOUNDARY_START + "(?=(" + body + ")" + _BOUNDARY_END + ")")
+
+    def __len__(self) -> int:
+        return len(self.triggers)
+
+    def __bool__(self) -> bool:
+        return bool(self.triggers)
+
+    def first(self, text: str, folded: bool = False) -> Optional[str]:
+        """
+        Find the first trigger present in the text, stopping the scan at the first hit.
+
+        Args:
+            text: The text to scan.
+            folded: Whether the text is already case-folded.
+
+        Returns:
+            The matching trigger, or None if nothing matched.
+        """
+        if not self._pattern or not text:
+            return None
+
+        match = self._pattern.search(text if folded else text.casefold())
+        if match:
+            return self._folded[match.group(1)]
+        return None
+
+    def best(self, text: str, folded: bool = False) -> Optional[str]:
+        """
+        Find the highest priority trigger present in the text - longest first, then alphabetical.
+
+        Args:
+            text: The text to scan.
+            folded: Whether the text is already case-folded.
+
+        Returns:
+            The matching trigger, or None if nothing matched.
+        """
+        if not self._overlapping or not text:
+            return None
+
+        found = {self._folded[match.group(1)] for match in self._overlapping.finditer(text if folded else text.casefold())}
+        if not found:
+            return None
+        return min(found, key=trigger_sort_key)
@@ -0,0 +1,196 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+from telegram import Chat, Message, MessageEntity, Update, User
+
+from tg_bot.modules.helper_funcs.chat_status import bot_has_right_sync, is_user_admin_sync
+from tg_bot.modules.helper_funcs.extraction import extract_text
+from tg_bot.modules.sql import locks_sql
+
+# update_id -> UpdateContext, for the updates currently going through the handlers
+ACTIVE_CONTEXTS = {}  # type: Dict[int, UpdateContext]
+CONTEXTS_LOCK = threading.Lock()
+
+
+def classify_message(message: Message) -> Tuple[int, int]:
+    """
+    Work out everything a message contains in one pass, instead of running each LOCK_TYPES/RESTRICTION_TYPES filter.
+
+    Args:
+        message: The message to classify.
+
+    Returns:
+        A (lock mask, restriction mask) tuple, using the bits from locks_sql.LOCK_BITS and locks_sql.RESTR_BITS.
+    """
+    lock_bits = locks_sql.LOCK_BITS
+    lock_mask = 0
+    if message.sticker:
+        lock_mask |= lock_bits['sticker']
+    if message.audio:
+        lock_mask |= lock_bits['audio']
+    if message.voice:
+        lock_mask |= lock_bits['voice']
+    if message.animation:
+        lock_mask |= lock_bits['gif']
+    elif message.document:
+        lock_mask |= lock_bits['document']
+    if message.video:
+        lock_mask |= lock_bits['video']
+    if message.video_note:
+        lock_mask |= lock_bits['videonote']
+    if message.contact:
+        lock_mask |= lock_bits['contact']
+    if message.photo:
+        lock_mask |= lock_bits['photo']
+    if any(ent.type == MessageEntity.URL for ent in message.entities) \
+            or any(ent.type == MessageEntity.URL for ent in message.caption_entities):
+        lock_mask |= lock_bits['url']
+    if message.new_chat_members:
+        lock_mask |= lock_bits['bots']
+    if message.forward_date:
+        lock_mask |= lock_bits['forward']
+    if message.game:
+        lock_mask |= lock_bits['game']
+    if message.location:
+        lock_mask |= lock_bits['location']
+
+    restr_bits = locks_sql.RESTR_BITS
+    restr_mask = 0
+    # same groupings as the MEDIA and OTHER filters - animations are documents too, so they count as both.
+    if message.audio or message.document or message.video or message.video_note or message.voice or message.photo:
+        restr_mask |= restr_bits['media']
+    if message.game or message.sticker or message.animation:
+        restr_mask |= restr_bits['other']
+    if restr_mask or message.text or message.contact or message.location or message.venue:
+        restr_mask |= restr_bits['messages']
+
+    return lock_mask, restr_mask
+
+
+class UpdateContext(object):
+    """
+    Everything the moderation handlers derive from an update, computed at most once and shared between them.
+
+    Every value is worked out on first access; the handlers of one update all get the same object through
+    get_update_context, so e.g. the text is only extracted and case-folded once, however many modules look at it.
+    """
+
+    def __init__(self, update: Update):
+        self.update = update
+        self._text = None  # type: Optional[str]
+        self._folded_text = None  # type: Optional[str]
+        self._entities = None  # type: Optional[Dict[MessageEntity, str]]
+        self._type_masks = None  # type: Optional[Tuple[int, int]]
+        self._sender_admin = None  # type: Optional[bool]
+        self._bot_rights = {}  # type: Dict[str, bool]
+
+    @property
+    def chat(self) -> Optional[Chat]:
+        return self.update.effective_chat
+
+    @property
+    def user(self) -> Optional[User]:
+        return self.update.effective_user
+
+    @property
+    def message(self) -> Optional[Message]:
+        return self.update.effective_message
+
+    @property
+    def text(self) -> str:
+        """The message text, caption or sticker emoji - whatever extract_text would return."""
+        if self._text is None:
+            self._text = extract_text(self.message) if self.message else ""
+        return self._text
+
+    @property
+    def folded_text(self) -> str:
+        """The text, case-folded for trigger matching."""
+        if self._folded_text is None:
+            self._folded_text = self.text.casefold()
+        return self._folded_text
+
+    @property
+    def entities(self) -> Dict[MessageEntity, str]:
+        """All entities of the message text and caption, mapped to the text they cover."""
+        if self._entities is None:
+            self._entities = {}
+            if self.message:
+                self._entities.update(self.message.parse_entities())
+                self._entities.update(self.message.parse_caption_entities())
+        return self._entities
+
+    def entities_of_type(self, *types: str) -> Dict[MessageEntity, str]:
+        return {ent: text for ent, text in self.entities.items() if ent.type in types}
+
+    @property
+    def type_masks(self) -> Tuple[int, int]:
+        """The (lock mask, restriction mask) of the message, as returned by classify_message."""
+        if self._type_masks is None:
+            self._type_masks = classify_message(self.message) if self.message else (0, 0)
+        return self._type_masks
+
+    def sender_is_admin(self) -> bool:
+        """
+        Check whether the sender of the update is an admin of the chat. Blocks on a cache miss, so only call it from the
+        sync handlers' worker threads.
+
+        Returns:
+            True if they are, False otherwise or if the update has no sender.
+        """
+        if self._sender_admin is None:
+            self._sender_admin = bool(self.user and self.chat) and is_user_admin_sync(self.chat, self.user.id)
+        return self._sender_admin
+
+    def bot_can(self, bot_id: int, right: str) -> bool:
+        """
+        Check whether the bot holds an admin right in the chat. Like sender_is_admin, only call it from a worker thread.
+
+        Args:
+            bot_id: The bot's user ID.
+            right: The ChatMember attribute to check, e.g. "can_delete_messages".
+
+        Returns:
+            True if the bot has that right.
+        """
+        if right not in self._bot_rights:
+            self._bot_rights[right] = bool(self.chat) and bot_has_right_sync(self.chat, bot_id, right)
+        return self._bot_rights[right]
+
+
+def open_update_context(update: Update) -> UpdateContext:
+    """
+    Create the shared context for an update that is about to go through the handlers.
+
+    Args:
+        update: The incoming update.
+
+    Returns:
+        The new UpdateContext.
+    """
+    context = UpdateContext(update)
+    with CONTEXTS_LOCK:
+        ACTIVE_CONTEXTS[update.update_id] = context
+    return context
+
+
+def close_update_context(update: Update) -> None:
+    with CONTEXTS_LOCK:
+        ACTIVE_CONTEXTS.pop(update.update_id, None)
+
+
+def get_update_context(update: Update) -> UpdateContext:
+    """
+    Get the shared context of an update.
+
+    Args:
+        update: The update being handled.
+
+    Returns:
+        The UpdateContext opened for it by the dispatcher, or a fresh, unshared one if there is none.
+    """
+    with CONTEXTS_LOCK:
+        context = ACTIVE_CONTEXTS.get(update.update_id)
+    if context is None or context.update is not update:
+        context = UpdateContext(update)
+    return context
@@ -0,0 +1,201 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Set, Tuple
+
+from tg_bot import LOGGER, WORKERS
+
+# How many chats may have an update being processed at once. Updates of other chats wait for a free slot.
+UPDATE_CONCURRENCY = WORKERS * 4
+# How many updates may be queued in the lanes, across all chats, before intake waits for some to finish.
+MAX_QUEUED_UPDATES = UPDATE_CONCURRENCY * 16
+# How many chats to keep per-chat latency stats for (the most recently active ones), and how many to show in /stats.
+LANE_STATS_SIZE = 1000
+LANE_STATS_SHOWN = 3
+# Weight of the newest update in a chat's moving average latency.
+LANE_LATENCY_WEIGHT = 0.2
+
+
+class UpdateLanes(object):
+    """
+    Gives every chat with pending updates its own lane, created when its first update arrives and dropped once it has
+    drained.
+
+    A lane handles its updates one after the other, so the updates of a single chat are always processed in the order
+    they arrived (flood counting, welcome cleaning, ... rely on that). Lanes of different chats run in parallel, at
+    most `concurrency` at once; a slow handler only holds up its own chat, and one concurrency slot. Once every slot is
+    taken, new lanes wait. Intake itself only waits once `max_queued` updates are queued across all lanes, so a burst
+    slows it down instead of piling up unbounded work.
+    """
+
+    def __init__(self, concurrency: int, max_queued: int):
+        self.concurrency = max(1, concurrency)
+        self.max_queued = max(1, max_queued)
+        self._slots = None  # type: Optional[asyncio.Semaphore]
+        self._intake = None  # type: Optional[asyncio.Semaphore]
+        self._lanes = {}  # type: Dict[Hashable, Deque[Tuple[float, asyncio.Future, Callable[..., Awaitable], tuple]]]
+        self._runners = set()  # type: Set[asyncio.Task]
+        self._saturated = False
+
+        self.processed = 0
+        self.total_wait = 0.0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.peak_lanes = 0
+        # chat_id -> [moving average latency, max latency, processed], least recently active first
+        self._chat_stats = OrderedDict()  # type: OrderedDict[Hashable, List[float]]
+
+    async def submit(self, chat_id: Hashable, func: Callable[..., Awaitable], *args) -> Any:
+        """
+        Run a coroutine function in the lane of the given chat, once everything queued before it has finished.
+
+        Args:
+            chat_id: The chat the update belongs to. Updates without a chat should pass None, and are run right away.
+            func: The coroutine function processing the update.
+            *args: Arguments for func.
+
+        Returns:
+            Whatever func returned.
+        """
+        if chat_id is None:
+            return await func(*args)
+
+        return await (await self._queue(chat_id, func, args))
+
+    async def enqueue(self, chat_id: Hashable, func: Callable[..., Awaitable], *args) -> None:
+        """
+        Like submit, but returns as soon as the update is queued, instead of once it has been processed. Errors raised
+        by func are logged.
+
+        Only waits while the lanes are full (see `max_queued`), so the caller isn't held up by a busy chat.
+
+        Args:
+            chat_id: The chat the update belongs to. Updates without a chat should pass None, and are run right away.
+            func: The coroutine function processing the update.
+            *args: Arguments for func.
+        """
+        if chat_id is None:
+            await func(*args)
+            return
+
+        future = await self._queue(chat_id, func, args)
+        future.add_done_callback(self._log_failure)
+
+    async def _queue(self, chat_id: Hashable, func: Callable[..., Awaitable], args: tuple) -> asyncio.Future:
+        if self._slots is None:
+            # created lazily, so that they belong to the running event loop
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._intake = asyncio.Semaphore(self.max_queued)
+
+        # released by the lane once the update is taken off it
+        await self._intake.acquire()
+
+        future = asyncio.get_running_loop().create_future()
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = deque()
+            # the loop only keeps weak references to tasks
+            runner = asyncio.create_task(self._run_lane(chat_id, lane))
+            self._runners.add(runner)
+            runner.add_done_callback(self._runners.discard)
+            self.peak_lanes = max(self.peak_lanes, len(self._lanes))
+        lane.append((time.monotonic(), future, func, args))
+        return future
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            excp = future.exception()
+            LOGGER.error("Error while processing a queued update", exc_info=(type(excp), excp, excp.__traceback__))
+
+    async def _run_lane(self, chat_id: Hashable, lane: Deque) -> None:
+        try:
+            while lane:
+                if self._slots.locked() and not self._saturated:
+                    self._saturated = True
+                    LOGGER.warning("All %d update slots busy (%d chats with pending updates), applying backpressure.",
+                                   self.concurrency, len(self._lanes))
+
+                async with self._slots:
+                    queued_at, future, func, args = lane.popleft()
+                    self._intake.release()
+                    started = time.monotonic()
+                    try:
+                        result = await func(*args)
+                    except Exception as excp:
+                        if not future.done():
+                            future.set_exception(excp)
+                    else:
+                        if not future.done():
+                            future.set_result(result)
+                    finally:
+                        latency = time.monotonic() - queued_at
+                        self.processed += 1
+                        self.total_wait += started - queued_at
+                        self.total_latency += latency
+                        self.max_latency = max(self.max_latency, latency)
+                        self._record_chat(chat_id, latency)
+        finally:
+            # no await between the last empty check and this, so nothing can have been queued in the meantime
+            del self._lanes[chat_id]
+            if self._saturated and not self._slots.locked():
+                self._saturated = False
+
+    def _record_chat(self, chat_id: Hashable, latency: float) -> None:
+        chat = self._chat_stats.pop(chat_id, None)
+        if chat is None:
+            chat = [latency, latency, 0]
+        else:
+            chat[0] += LANE_LATENCY_WEIGHT * (latency - chat[0])
+            chat[1] = max(chat[1], latency)
+        chat[2] += 1
+        self._chat_stats[chat_id] = chat
+        if len(self._chat_stats) > LANE_STATS_SIZE:
+            self._chat_stats.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the load of the lanes.
+
+        Returns:
+            A dict with the number of open lanes (and the most there ever were), the number of queued and processed
+            updates, and the average queue wait, average latency and max latency (seconds) of the processed ones.
+            "deepest" and "slowest" list the chats with the most queued updates and the highest moving average
+            latency, as dicts with the chat_id, its current depth, and its average and max latency.
+        """
+        done = self.processed
+
+        def chat(chat_id):
+            avg, peak, _ = self._chat_stats.get(chat_id, (0.0, 0.0, 0))
+            lane = self._lanes.get(chat_id)
+            return {"chat_id": chat_id, "depth": len(lane) if lane else 0, "avg_latency": avg, "max_latency": peak}
+
+        deepest = sorted(self._lanes, key=lambda chat_id: len(self._lanes[chat_id]), reverse=True)
+        slowest = sorted(self._chat_stats, key=lambda chat_id: self._chat_stats[chat_id][0], reverse=True)
+        return {"lanes": len(self._lanes),
+                "peak_lanes": self.peak_lanes,
+                "depth": sum(len(lane) for lane in self._lanes.values()),
+                "processed": done,
+                "avg_wait": self.total_wait / done if done else 0.0,
+                "avg_latency": self.total_latency / done if done else 0.0,
+                "max_latency": self.max_latency,
+                "deepest": [chat(chat_id) for chat_id in deepest[:LANE_STATS_SHOWN]],
+                "slowest": [chat(chat_id) for chat_id in slowest[:LANE_STATS_SHOWN]]}
+
+    def __stats__(self) -> str:
+        stats = self.stats()
+        return "{} chat lanes open (peak {}), {} updates queued, {} processed; {:.0f}ms average latency " \
+               "(max {:.0f}ms).".format(stats["lanes"], stats["peak_lanes"], stats["depth"], stats["processed"],
+                                        stats["avg_latency"] * 1000, stats["max_latency"] * 1000) + \
+            "\nDeepest lanes: {}\nSlowest lanes: {}".format(self._format_chats(stats["deepest"]),
+                                                           self._format_chats(stats["slowest"]))
+
+    @staticmethod
+    def _format_chats(chats: List[Dict[str, Any]]) -> str:
+        if not chats:
+            return "none"
+        return ", ".join("{} ({} queued, {:.0f}ms avg, max {:.0f}ms)".format(
+            chat["chat_id"], chat["depth"], chat["avg_latency"] * 1000, chat["max_latency"] * 1000) for chat in chats)
+
+
+UPDATE_LANES = UpdateLanes(UPDATE_CONCURRENCY, MAX_QUEUED_UPDATES)
@@ -12,8 +12,10 @@ from telegram.utils.helpers import mention_html
 import tg_bot.modules.sql.locks_sql as sql
 from tg_bot import dispatcher, SUDO_USERS, LOGGER
 from tg_bot.modules.disable import DisableAbleCommandHandler
+from tg_bot.modules.helper_funcs.chat_features import register_group_feature
 from tg_bot.modules.helper_funcs.chat_status import can_delete, is_user_admin, user_not_admin, user_admin, \
     bot_can_delete, is_bot_admin
+from tg_bot.modules.helper_funcs.update_context import get_update_context
 from tg_bot.modules.log_channel import loggable
 from tg_bot.modules.sql import users_sql
 
@@ -192,49 +194,59 @@ def unlock(bot: Bot, update: Update, args: List[str]) -> str:
 @run_async
 @user_not_admin
 def del_lockables(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    message = update.effective_message  # type: Optional[Message]
-
-    for lockable, filter in LOCK_TYPES.items():
-        if filter(message) and sql.is_locked(chat.id, lockable) and can_delete(chat, bot.id):
-            if lockable == "bots":
-                new_members = update.effective_message.new_chat_members
-                for new_mem in new_members:
-                    if new_mem.is_bot:
-                        if not is_bot_admin(chat, bot.id):
-                            message.reply_text("I see a bot, and I've been told to stop them joining... "
-                                               "but I'm not admin!")
-                            return
-
-                        chat.kick_member(new_mem.id)
-                        message.reply_text("Only admins are allowed to add bots to this chat! Get outta here.")
-            else:
-                try:
-                    message.delete()
-                except BadRequest as excp:
-                    if excp.message == "Message to delete not found":
-                        pass
-                    else:
-                        LOGGER.exception("ERROR in lockables")
-
-            break
-
-
-@run_async
-@user_not_admin
-def rest_handler(bot: Bot, update: Update):
-    msg = update.effective_message  # type: Optional[Message]
-    chat = update.effective_chat  # type: Optional[Chat]
-    for restriction, filter in RESTRICTION_TYPES.items():
-        if filter(msg) and sql.is_restr_locked(chat.id, restriction) and can_delete(chat, bot.id):
+    ctx = get_update_context(update)
+    chat = ctx.chat  # type: Optional[Chat]
+    message = ctx.message  # type: Optional[Message]
+
+    chat_locks = sql.get_lock_mask(chat.id)
+    if not chat_locks:
+        return
+
+    lock_mask, _ = ctx.type_masks
+    hits = lock_mask & chat_locks
+    if hits and ctx.bot_can(bot.id, "can_delete_messages"):
+        if hits & sql.LOCK_BITS['bots']:
+            new_members = update.effective_message.new_chat_members
+            for new_mem in new_members:
+                if new_mem.is_bot:
+                    if not is_bot_admin(chat, bot.id):
+                        message.reply_text("I see a bot, and I've been told to stop them joining... "
+                                           "but I'm not admin!")
+                        return
+
+                    chat.kick_member(new_mem.id)
+                    message.reply_text("Only admins are allowed to add bots to this chat! Get outta here.")
+        else:
             try:
-                msg.delete()
+                message.delete()
             except BadRequest as excp:
                 if excp.message == "Message to delete not found":
                     pass
                 else:
-                    LOGGER.exception("ERROR in restrictions")
-            break
+                    LOGGER.exception("ERROR in lockables")
+
+
+@run_async
+@user_not_admin
+def rest_handler(bot: Bot, update: Update):
+    ctx = get_update_context(update)
+    msg = ctx.message  # type: Optional[Message]
+    chat = ctx.chat  # type: Optional[Chat]
+    chat_restr = sql.get_restr_mask(chat.id)
+    if not chat_restr:
+        return
+
+    _, restr_mask = ctx.type_masks
+    # an "all" restriction applies to every message, whatever it contains
+    restricted = restr_mask & chat_restr or chat_restr & sql.RESTR_BITS['all'] == sql.RESTR_BITS['all']
+    if restricted and ctx.bot_can(bot.id, "can_delete_messages"):
+        try:
+            msg.delete()
+        except BadRequest as excp:
+            if excp.message == "Message to delete not found":
+                pass
+            else:
+                LOGGER.exception("ERROR in restrictions")
 
 
 def build_lock_message(chat_id):
@@ -318,3 +330,5 @@ dispatcher.add_handler(LOCKED_HANDLER)
 
 dispatcher.add_handler(MessageHandler(Filters.all & Filters.group, del_lockables), PERM_GROUP)
 dispatcher.add_handler(MessageHandler(Filters.all & Filters.group, rest_handler), REST_GROUP)
+register_group_feature(PERM_GROUP, "locks")
+register_group_feature(REST_GROUP, "restrictions")
@@ -9,6 +9,7 @@ from telegram.utils.helpers import mention_html
 
 from tg_bot import dispatcher, LOGGER
 from tg_bot.modules.helper_funcs.chat_status import user_admin, can_delete
+from tg_bot.modules.helper_funcs.outbound import OUTBOUND, PRIORITY_MODERATION
 from tg_bot.modules.log_channel import loggable
 
 
@@ -31,7 +32,7 @@ def purge(bot: Bot, update: Update, args: List[str]) -> str:
 
             for m_id in range(delete_to, message_id - 1, -1):  # Reverse iteration over message ids
                 try:
-                    bot.deleteMessage(chat.id, m_id)
+                    OUTBOUND.call_threadsafe(None, PRIORITY_MODERATION, bot.deleteMessage, chat.id, m_id)
                 except BadRequest as err:
                     if err.message == "Message can't be deleted":
                         bot.send_message(chat.id, "Cannot delete all messages. The messages may be too old, I might "
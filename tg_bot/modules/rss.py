@@ -1,27 +1,47 @@
+import asyncio
+import hashlib
 import html
 import re
 
-from feedparser import parse
 from telegram import ParseMode, constants
 from telegram.ext import CommandHandler
 
 from tg_bot import dispatcher, updater
 from tg_bot.modules.helper_funcs.chat_status import user_admin
+from tg_bot.modules.helper_funcs.feed_fetcher import FEED_FETCHER
+from tg_bot.modules.helper_funcs.feed_parser import FEED_PARSER
+from tg_bot.modules.helper_funcs.feed_scheduler import FEED_SCHEDULE
+from tg_bot.modules.helper_funcs.misc import split_message
+from tg_bot.modules.helper_funcs.outbound import OUTBOUND, PRIORITY_BULK
 from tg_bot.modules.sql import rss_sql as sql
 
+# how often the scheduler is checked for feeds that are due; each feed has its own, adaptive, poll interval
+RSS_TICK = 15
+# digest lines are kept well under the message limit, so that splitting a long digest never has to cut a line
+DIGEST_TITLE_LENGTH = 200
+DIGEST_LINE_LENGTH = 1000
+
+
+def load_feed(tg_feed_link):
+    """Fetch and parse a feed for a command. Returns None if the link couldn't be fetched or parsed."""
+    result = FEED_FETCHER.get(tg_feed_link, conditional=False)
+    if not result.ok:
+        return None
+    return FEED_PARSER.parse(result.body)
+
 
 def show_url(bot, update, args):
     tg_chat_id = str(update.effective_chat.id)
 
     if len(args) >= 1:
         tg_feed_link = args[0]
-        link_processed = parse(tg_feed_link)
+        link_processed = load_feed(tg_feed_link)
 
-        if link_processed.bozo == 0:
-            feed_title = link_processed.feed.get("title", default="Unknown")
+        if link_processed and not link_processed["bozo"]:
+            feed_title = link_processed["title"] or "Unknown"
             feed_description = "<i>{}</i>".format(
-                re.sub('<[^<]+?>', '', link_processed.feed.get("description", default="Unknown")))
-            feed_link = link_processed.feed.get("link", default="Unknown")
+                re.sub('<[^<]+?>', '', link_processed["description"] or "Unknown"))
+            feed_link = link_processed["link"] or "Unknown"
 
             feed_message = "<b>Feed Title:</b> \n{}" \
                            "\n\n<b>Feed Description:</b> \n{}" \
@@ -29,11 +49,11 @@ def show_url(bot, update, args):
                                                                feed_description,
                                                                html.escape(feed_link))
 
-            if len(link_processed.entries) >= 1:
-                entry_title = link_processed.entries[0].get("title", default="Unknown")
+            if len(link_processed["entries"]) >= 1:
+                entry_title = link_processed["entries"][0]["title"] or "Unknown"
                 entry_description = "<i>{}</i>".format(
-                    re.sub('<[^<]+?>', '', link_processed.entries[0].get("description", default="Unknown")))
-                entry_link = link_processed.entries[0].get("link", default="Unknown")
+                    re.sub('<[^<]+?>', '', link_processed["latest_description"] or "Unknown"))
+                entry_link = link_processed["entries"][0]["link"] or "Unknown"
 
                 entry_message = "\n\n<b>Entry Title:</b> \n{}" \
                                 "\n\n<b>Entry Description:</b> \n{}" \
@@ -80,12 +100,12 @@ def add_url(bot, update, args):
 
         tg_feed_link = args[0]
 
-        link_processed = parse(tg_feed_link)
+        link_processed = load_feed(tg_feed_link)
 
         # check if link is a valid RSS Feed link
-        if link_processed.bozo == 0:
-            if len(link_processed.entries[0]) >= 1:
-                tg_old_entry_link = link_processed.entries[0].link
+        if link_processed and not link_processed["bozo"]:
+            if len(link_processed["entries"]) >= 1:
+                tg_old_entry_link = link_processed["entries"][0]["link"]
             else:
                 tg_old_entry_link = ""
 
@@ -97,6 +117,8 @@ def add_url(bot, update, args):
                 update.effective_message.reply_text("This URL has already been added")
             else:
                 sql.add_url(tg_chat_id, tg_feed_link, tg_old_entry_link)
+                if sql.get_seen_entries(tg_feed_link) is None:
+                    sql.set_seen_entries(tg_feed_link, [entry_hash(entry) for entry in link_processed["entries"]])
 
                 update.effective_message.reply_text("Added URL to subscription")
         else:
@@ -112,107 +134,231 @@ def remove_url(bot, update, args):
 
         tg_feed_link = args[0]
 
-        link_processed = parse(tg_feed_link)
-
-        if link_processed.bozo == 0:
-            user_data = sql.check_url_availability(tg_chat_id, tg_feed_link)
+        # no need to fetch the feed - if it's subscribed to, it was a valid one
+        user_data = sql.check_url_availability(tg_chat_id, tg_feed_link)
 
-            if user_data:
-                sql.remove_url(tg_chat_id, tg_feed_link)
+        if user_data:
+            sql.remove_url(tg_chat_id, tg_feed_link)
 
-                update.effective_message.reply_text("Removed URL from subscription")
-            else:
-                update.effective_message.reply_text("You haven't subscribed to this URL yet")
+            update.effective_message.reply_text("Removed URL from subscription")
         else:
-            update.effective_message.reply_text("This link is not an RSS Feed link")
+            update.effective_message.reply_text("You haven't subscribed to this URL yet")
     else:
         update.effective_message.reply_text("URL missing")
 
 
-def rss_update(bot, job):
-    user_data = sql.get_all()
+@user_admin
+def set_digest(bot, update, args):
+    if len(args) >= 2 and args[1].lower() in ("on", "yes", "off", "no"):
+        tg_chat_id = str(update.effective_chat.id)
+        tg_feed_link = args[0]
+
+        if not sql.check_url_availability(tg_chat_id, tg_feed_link):
+            update.effective_message.reply_text("You haven't subscribed to this URL yet")
+        elif args[1].lower() in ("on", "yes"):
+            sql.set_digest(tg_chat_id, tg_feed_link, True)
+            update.effective_message.reply_text("New entries from this feed will now come in a single digest message")
+        else:
+            sql.set_digest(tg_chat_id, tg_feed_link, False)
+            update.effective_message.reply_text("New entries from this feed will now be sent one by one")
+    else:
+        update.effective_message.reply_text("Give me a subscribed link and on/off!")
 
-    # this loop checks for every row in the DB
-    for row in user_data:
-        row_id = row.id
-        tg_chat_id = row.chat_id
-        tg_feed_link = row.feed_link
 
-        feed_processed = parse(tg_feed_link)
+async def send_feed_message(bot, chat_id, text):
+    # feed pushes are bulk traffic - they queue behind moderation actions and command replies
+    await OUTBOUND.call(int(chat_id), PRIORITY_BULK, bot.send_message, int(chat_id), text, parse_mode=ParseMode.HTML)
 
-        tg_old_entry_link = row.old_entry_link
 
-        new_entry_links = []
-        new_entry_titles = []
+async def fetch_feeds(feed_links):
+    """
+    Fetch and parse every distinct feed once.
 
-        # this loop checks for every entry from the RSS Feed link from the DB row
-        for entry in feed_processed.entries:
-            # check if there are any new updates to the RSS Feed from the old entry
-            if entry.link != tg_old_entry_link:
-                new_entry_links.append(entry.link)
-                new_entry_titles.append(entry.title)
-            else:
-                break
+    Returns:
+        The (FetchResult, parsed feed) of each feed, by link, leaving out the ones which haven't changed; and the links
+        which couldn't be fetched or parsed. Pass the FetchResult to FEED_FETCHER.remember once the feed's entries
+        have been recorded.
+    """
+    results = await FEED_FETCHER.fetch_all(feed_links)
+    changed = {feed_link: result for feed_link, result in results.items() if not result.not_modified}
 
-        # check if there's any new entries queued from the last check
-        if new_entry_links:
-            sql.update_url(row_id, new_entry_links)
+    # one parse per parser process at a time, so waiting parses don't each hold a thread
+    slots = asyncio.Semaphore(FEED_PARSER.workers)
+
+    async def parse(result):
+        if not result.ok:
+            return None
+        async with slots:
+            return await asyncio.to_thread(FEED_PARSER.parse, result.body)
+
+    parsed = await asyncio.gather(*(parse(result) for result in changed.values()))
+
+    feeds = {}
+    failed = set()
+    for (feed_link, result), feed_processed in zip(changed.items(), parsed):
+        if feed_processed is None:
+            failed.add(feed_link)
         else:
-            pass
+            feeds[feed_link] = (result, feed_processed)
+    return feeds, failed
 
-        if len(new_entry_links) < 5:
-            # this loop sends every new update to each user from each group based on the DB entries
-            for link, title in zip(reversed(new_entry_links), reversed(new_entry_titles)):
-                final_message = "<b>{}</b>\n\n{}".format(html.escape(title), html.escape(link))
 
-                if len(final_message) <= constants.MAX_MESSAGE_LENGTH:
-                    bot.send_message(chat_id=tg_chat_id, text=final_message, parse_mode=ParseMode.HTML)
-                else:
-                    bot.send_message(chat_id=tg_chat_id, text="<b>Warning:</b> The message is too long to be sent",
-                                     parse_mode=ParseMode.HTML)
+def get_new_entries(feed_processed, tg_old_entry_link):
+    new_entry_links = []
+    new_entry_titles = []
+
+    # this loop checks for every entry from the RSS Feed link from the DB row
+    for entry in feed_processed["entries"]:
+        # check if there are any new updates to the RSS Feed from the old entry
+        if entry["link"] != tg_old_entry_link:
+            new_entry_links.append(entry["link"])
+            new_entry_titles.append(entry["title"])
         else:
-            for link, title in zip(reversed(new_entry_links[-5:]), reversed(new_entry_titles[-5:])):
-                final_message = "<b>{}</b>\n\n{}".format(html.escape(title), html.escape(link))
+            break
+
+    return new_entry_links, new_entry_titles
+
+
+def entry_hash(entry):
+    """A 64 bit hash of an entry's guid, which is what the seen-entry store keeps."""
+    digest = hashlib.blake2b((entry["guid"] or entry["link"]).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+async def advance_feed(tg_feed_link, feed_processed, subscribers):
+    """
+    Work out the new entries of a feed for each of its subscribers, and record them as seen.
+
+    Args:
+        tg_feed_link: The feed.
+        feed_processed: The parsed feed.
+        subscribers: chat_id -> old_entry_link, from the subscription index.
+
+    Returns:
+        chat_id -> (new entry links, new entry titles), newest first, for the chats that have new entries.
+    """
+    entries = feed_processed["entries"]
+    entry_hashes = [entry_hash(entry) for entry in entries]
+    seen = sql.get_seen_entries(tg_feed_link)
+
+    if seen is None:
+        # no seen entries recorded for this feed yet, so fall back on each chat's old_entry_link this once; chats
+        # which were at the same point get the same entries, so each cursor is only looked up once
+        by_cursor = {}
+        new_entries = {}
+        for tg_chat_id, tg_old_entry_link in subscribers.items():
+            if tg_old_entry_link not in by_cursor:
+                by_cursor[tg_old_entry_link] = get_new_entries(feed_processed, tg_old_entry_link)
+            if by_cursor[tg_old_entry_link][0]:
+                new_entries[tg_chat_id] = by_cursor[tg_old_entry_link]
+    else:
+        # reordered or edited entries keep their guid, so they don't come up again
+        fresh = [entry for entry, h in zip(entries, entry_hashes) if h not in seen]
+        if not fresh:
+            return {}
+        new = ([entry["link"] for entry in fresh], [entry["title"] for entry in fresh])
+        new_entries = {tg_chat_id: new for tg_chat_id in subscribers}
+
+    await asyncio.to_thread(sql.set_seen_entries, tg_feed_link, entry_hashes)
+    return new_entries
 
-                if len(final_message) <= constants.MAX_MESSAGE_LENGTH:
-                    bot.send_message(chat_id=tg_chat_id, text=final_message, parse_mode=ParseMode.HTML)
-                else:
-                    bot.send_message(chat_id=tg_chat_id, text="<b>Warning:</b> The message is too long to be sent",
-                                     parse_mode=ParseMode.HTML)
 
-            bot.send_message(chat_id=tg_chat_id, parse_mode=ParseMode.HTML,
-                             text="<b>Warning: </b>{} occurrences have been left out to prevent spam"
-                             .format(len(new_entry_links) - 5))
+async def send_new_entries(bot, tg_chat_id, new_entry_links, new_entry_titles):
+    # this loop sends every new update to each user from each group based on the DB entries
+    for link, title in zip(reversed(new_entry_links[-5:]), reversed(new_entry_titles[-5:])):
+        final_message = "<b>{}</b>\n\n{}".format(html.escape(title), html.escape(link))
 
+        if len(final_message) <= constants.MAX_MESSAGE_LENGTH:
+            await send_feed_message(bot, tg_chat_id, final_message)
+        else:
+            await send_feed_message(bot, tg_chat_id, "<b>Warning:</b> The message is too long to be sent")
+
+    if len(new_entry_links) >= 5:
+        await send_feed_message(bot, tg_chat_id, "<b>Warning: </b>{} occurrences have been left out to prevent spam"
+                                .format(len(new_entry_links) - 5))
+
+
+def digest_title(title):
+    # one line per entry: newlines in a title would let split_message cut inside its <a> tag
+    title = " ".join(title.split())
+    if len(title) > DIGEST_TITLE_LENGTH:
+        title = title[:DIGEST_TITLE_LENGTH - 1].rstrip() + "…"
+    return html.escape(title)
+
+
+def format_digest(feed_title, new_entry_links, new_entry_titles):
+    lines = ["<b>{}</b>".format(digest_title(feed_title))]
+    # oldest first, like the one-by-one messages
+    for link, title in zip(reversed(new_entry_links), reversed(new_entry_titles)):
+        line = '- <a href="{}">{}</a>'.format(html.escape(link), digest_title(title or link))
+        if len(line) > DIGEST_LINE_LENGTH:
+            # a link that long can't be shortened without breaking it, so the entry goes in without one
+            line = "- {}".format(digest_title(title or link))
+        lines.append(line)
+    return "\n".join(lines)
+
+
+async def send_digest(bot, tg_chat_id, sections):
+    # every digest feed of a chat that updated this cycle goes into the same message, split only if it's too long
+    for chunk in split_message("\n\n".join(sections)):
+        await send_feed_message(bot, tg_chat_id, chunk)
+
+
+async def deliver_chat(bot, tg_chat_id, one_by_one, digest_sections):
+    for new_entry_links, new_entry_titles in one_by_one:
+        await send_new_entries(bot, tg_chat_id, new_entry_links, new_entry_titles)
+    if digest_sections:
+        await send_digest(bot, tg_chat_id, digest_sections)
+
+
+async def rss_update(context):
+    subscriptions = sql.get_subscriptions()
+    FEED_SCHEDULE.sync(subscriptions)
+
+    # only the feeds that are due get polled; each is fetched once, however many chats are subscribed to it
+    due = FEED_SCHEDULE.pop_due()
+    if not due:
+        return
+
+    fresh = set()
+    failed = set(due)
+    try:
+        feeds, failed = await fetch_feeds(due)
+
+        # chat_id -> ([(links, titles) sent one by one], [digest sections])
+        deliveries = {}
+        for tg_feed_link, (result, feed_processed) in feeds.items():
+            new_entries = await advance_feed(tg_feed_link, feed_processed, subscriptions[tg_feed_link])
+            # only now is it safe to skip this version of the feed on the next poll
+            FEED_FETCHER.remember(result)
+            if new_entries:
+                fresh.add(tg_feed_link)
+
+            for tg_chat_id, (links, titles) in new_entries.items():
+                one_by_one, digest_sections = deliveries.setdefault(tg_chat_id, ([], []))
+                if sql.is_digest(tg_chat_id, tg_feed_link):
+                    digest_sections.append(format_digest(feed_processed["title"] or tg_feed_link, links, titles))
+                else:
+                    one_by_one.append((links, titles))
 
-def rss_set(bot, job):
-    user_data = sql.get_all()
+        await asyncio.gather(*(deliver_chat(context.bot, tg_chat_id, one_by_one, digest_sections)
+                               for tg_chat_id, (one_by_one, digest_sections) in deliveries.items()))
+    finally:
+        for tg_feed_link in due:
+            FEED_SCHEDULE.reschedule(tg_feed_link, fresh=tg_feed_link in fresh, failed=tg_feed_link in failed)
 
-    # this loop checks for every row in the DB
-    for row in user_data:
-        row_id = row.id
-        tg_feed_link = row.feed_link
-        tg_old_entry_link = row.old_entry_link
 
-        feed_processed = parse(tg_feed_link)
+async def rss_set(context):
+    subscriptions = sql.get_subscriptions()
+    feeds, _ = await fetch_feeds(subscriptions)
 
-        new_entry_links = []
-        new_entry_titles = []
+    for tg_feed_link, (result, feed_processed) in feeds.items():
+        await advance_feed(tg_feed_link, feed_processed, subscriptions[tg_feed_link])
+        FEED_FETCHER.remember(result)
 
-        # this loop checks for every entry from the RSS Feed link from the DB row
-        for entry in feed_processed.entries:
-            # check if there are any new updates to the RSS Feed from the old entry
-            if entry.link != tg_old_entry_link:
-                new_entry_links.append(entry.link)
-                new_entry_titles.append(entry.title)
-            else:
-                break
 
-        # check if there's any new entries queued from the last check
-        if new_entry_links:
-            sql.update_url(row_id, new_entry_links)
-        else:
-            pass
+def __stats__():
+    return "{}\n{}\n{}".format(FEED_SCHEDULE.__stats__(), FEED_FETCHER.__stats__(), FEED_PARSER.__stats__())
 
 
 __help__ = """
@@ -220,6 +366,7 @@ __help__ = """
  - /removerss <link>: removes the RSS link from the subscriptions.
  - /rss <link>: shows the link's data and the last entry, for testing purposes.
  - /listrss: shows the list of rss feeds that the chat is currently subscribed to.
+ - /rssdigest <link> <on/off>: get all of a feed's new entries in one message per update, instead of one by one.
 
 NOTE: In groups, only admins can add/remove RSS links to the group's subscription
 """
@@ -229,7 +376,7 @@ __mod_name__ = "RSS Feed"
 job = updater.job_queue
 
 job_rss_set = job.run_once(rss_set, 5)
-job_rss_update = job.run_repeating(rss_update, interval=60, first=60)
+job_rss_update = job.run_repeating(rss_update, interval=RSS_TICK, first=60)
 job_rss_set.enabled = True
 job_rss_update.enabled = True
 
@@ -237,8 +384,10 @@ SHOW_URL_HANDLER = CommandHandler("rss", show_url, pass_args=True)
 ADD_URL_HANDLER = CommandHandler("addrss", add_url, pass_args=True)
 REMOVE_URL_HANDLER = CommandHandler("removerss", remove_url, pass_args=True)
 LIST_URLS_HANDLER = CommandHandler("listrss", list_urls)
+DIGEST_HANDLER = CommandHandler("rssdigest", set_digest, pass_args=True)
 
 dispatcher.add_handler(SHOW_URL_HANDLER)
 dispatcher.add_handler(ADD_URL_HANDLER)
 dispatcher.add_handler(REMOVE_URL_HANDLER)
 dispatcher.add_handler(LIST_URLS_HANDLER)
+dispatcher.add_handler(DIGEST_HANDLER)
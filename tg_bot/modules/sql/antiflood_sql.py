@@ -2,6 +2,7 @@ import threading
 
 from sqlalchemy import Column, Integer, String
 
+from tg_bot.modules.helper_funcs.chat_features import set_chat_feature
 from tg_bot.modules.sql import BASE, SESSION
 
 DEF_COUNT = 0
@@ -40,6 +41,7 @@ def set_flood(chat_id, amount):
         flood.limit = amount
 
         CHAT_FLOOD[str(chat_id)] = (None, DEF_COUNT, amount)
+        set_chat_feature(chat_id, "antiflood", bool(amount))
 
         SESSION.add(flood)
         SESSION.commit()
@@ -75,6 +77,8 @@ def migrate_chat(old_chat_id, new_chat_id):
         flood = SESSION.query(FloodControl).get(str(old_chat_id))
         if flood:
             CHAT_FLOOD[str(new_chat_id)] = CHAT_FLOOD.get(str(old_chat_id), DEF_OBJ)
+            set_chat_feature(old_chat_id, "antiflood", False)
+            set_chat_feature(new_chat_id, "antiflood", bool(CHAT_FLOOD[str(new_chat_id)][2]))
             flood.chat_id = str(new_chat_id)
             SESSION.commit()
 
@@ -86,6 +90,8 @@ def __load_flood_settings():
     try:
         all_chats = SESSION.query(FloodControl).all()
         CHAT_FLOOD = {chat.chat_id: (None, DEF_COUNT, chat.limit) for chat in all_chats}
+        for chat_id, (_, _, limit) in CHAT_FLOOD.items():
+            set_chat_feature(chat_id, "antiflood", bool(limit))
     finally:
         SESSION.close()
 
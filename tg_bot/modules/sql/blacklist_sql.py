@@ -2,6 +2,8 @@ import threading
 
 from sqlalchemy import func, distinct, Column, String, UnicodeText
 
+from tg_bot.modules.helper_funcs.chat_features import set_chat_feature
+from tg_bot.modules.helper_funcs.trigger_matching import TriggerMatcher
 from tg_bot.modules.sql import SESSION, BASE
 
 
@@ -28,6 +30,8 @@ BlackListFilters.__table__.create(checkfirst=True)
 BLACKLIST_FILTER_INSERTION_LOCK = threading.RLock()
 
 CHAT_BLACKLISTS = {}
+# compiled on first use, dropped whenever the chat's blacklist changes
+CHAT_BLACKLIST_MATCHERS = {}
 
 
 def add_to_blacklist(chat_id, trigger):
@@ -37,6 +41,8 @@ def add_to_blacklist(chat_id, trigger):
         SESSION.merge(blacklist_filt)  # merge to avoid duplicate key issues
         SESSION.commit()
         CHAT_BLACKLISTS.setdefault(str(chat_id), set()).add(trigger)
+        CHAT_BLACKLIST_MATCHERS.pop(str(chat_id), None)
+        set_chat_feature(chat_id, "blacklist", True)
 
 
 def rm_from_blacklist(chat_id, trigger):
@@ -45,6 +51,8 @@ def rm_from_blacklist(chat_id, trigger):
         if blacklist_filt:
             if trigger in CHAT_BLACKLISTS.get(str(chat_id), set()):  # sanity check
                 CHAT_BLACKLISTS.get(str(chat_id), set()).remove(trigger)
+                CHAT_BLACKLIST_MATCHERS.pop(str(chat_id), None)
+                set_chat_feature(chat_id, "blacklist", bool(CHAT_BLACKLISTS.get(str(chat_id))))
 
             SESSION.delete(blacklist_filt)
             SESSION.commit()
@@ -58,6 +66,21 @@ def get_chat_blacklist(chat_id):
     return CHAT_BLACKLISTS.get(str(chat_id), set())
 
 
+def find_blacklisted(chat_id, text, folded=False):
+    """Return the first blacklisted trigger found in the text, or None."""
+    matcher = CHAT_BLACKLIST_MATCHERS.get(str(chat_id))
+    if matcher is None:
+        triggers = CHAT_BLACKLISTS.get(str(chat_id))
+        if not triggers:
+            return None
+
+        with BLACKLIST_FILTER_INSERTION_LOCK:
+            matcher = TriggerMatcher(CHAT_BLACKLISTS.get(str(chat_id), set()))
+            CHAT_BLACKLIST_MATCHERS[str(chat_id)] = matcher
+
+    return matcher.first(text, folded)
+
+
 def num_blacklist_filters():
     try:
         return SESSION.query(BlackListFilters).count()
@@ -91,6 +114,8 @@ def __load_chat_blacklists():
             CHAT_BLACKLISTS[x.chat_id] += [x.trigger]
 
         CHAT_BLACKLISTS = {x: set(y) for x, y in CHAT_BLACKLISTS.items()}
+        for chat_id, triggers in CHAT_BLACKLISTS.items():
+            set_chat_feature(chat_id, "blacklist", bool(triggers))
 
     finally:
         SESSION.close()
@@ -103,5 +128,12 @@ def migrate_chat(old_chat_id, new_chat_id):
             filt.chat_id = str(new_chat_id)
         SESSION.commit()
 
+        if str(old_chat_id) in CHAT_BLACKLISTS:
+            CHAT_BLACKLISTS[str(new_chat_id)] = CHAT_BLACKLISTS.pop(str(old_chat_id))
+        CHAT_BLACKLIST_MATCHERS.pop(str(old_chat_id), None)
+        CHAT_BLACKLIST_MATCHERS.pop(str(new_chat_id), None)
+        set_chat_feature(old_chat_id, "blacklist", False)
+        set_chat_feature(new_chat_id, "blacklist", bool(CHAT_BLACKLISTS.get(str(new_chat_id))))
+
 
 __load_chat_blacklists()
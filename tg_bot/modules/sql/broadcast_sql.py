@@ -0,0 +1,73 @@
+import threading
+
+from sqlalchemy import Column, Integer, String, UnicodeText, Boolean
+
+from tg_bot.modules.sql import BASE, SESSION
+
+
+class Broadcasts(BASE):
+    __tablename__ = "broadcasts"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    origin_chat_id = Column(String(14), nullable=False)
+    text = Column(UnicodeText, nullable=False)
+    # chats are sent to in chat_id order; this is the last one done, so a restart picks up after it
+    cursor = Column(String(14), nullable=False, default="")
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    dead = Column(Integer, nullable=False, default=0)
+    finished = Column(Boolean, nullable=False, default=False)
+
+    def __init__(self, origin_chat_id, text):
+        self.origin_chat_id = str(origin_chat_id)
+        self.text = text
+        self.cursor = ""
+        self.sent = 0
+        self.failed = 0
+        self.dead = 0
+        self.finished = False
+
+    def __repr__(self):
+        return "<Broadcast {} ({} sent, {} failed, {} dead)>".format(self.id, self.sent, self.failed, self.dead)
+
+
+Broadcasts.__table__.create(checkfirst=True)
+
+BROADCAST_LOCK = threading.RLock()
+
+
+def new_broadcast(origin_chat_id, text):
+    with BROADCAST_LOCK:
+        broadcast = Broadcasts(origin_chat_id, text)
+        SESSION.add(broadcast)
+        SESSION.commit()
+        broadcast_id = broadcast.id
+        SESSION.close()
+        return broadcast_id
+
+
+def get_broadcast(broadcast_id):
+    try:
+        return SESSION.query(Broadcasts).get(broadcast_id)
+    finally:
+        SESSION.close()
+
+
+def checkpoint_broadcast(broadcast_id, cursor, sent, failed, dead, finished=False):
+    with BROADCAST_LOCK:
+        broadcast = SESSION.query(Broadcasts).get(broadcast_id)
+        if broadcast:
+            broadcast.cursor = cursor
+            broadcast.sent = sent
+            broadcast.failed = failed
+            broadcast.dead = dead
+            broadcast.finished = finished
+            SESSION.commit()
+        SESSION.close()
+
+
+def get_unfinished_broadcasts():
+    try:
+        return [broadcast.id for broadcast in
+                SESSION.query(Broadcasts).filter(Broadcasts.finished.is_(False)).order_by(Broadcasts.id).all()]
+    finally:
+        SESSION.close()
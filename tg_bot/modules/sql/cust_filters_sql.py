@@ -2,6 +2,8 @@ import threading
 
 from sqlalchemy import Column, String, UnicodeText, Boolean, Integer, distinct, func
 
+from tg_bot.modules.helper_funcs.chat_features import set_chat_feature
+from tg_bot.modules.helper_funcs.trigger_matching import TriggerMatcher, trigger_sort_key
 from tg_bot.modules.sql import BASE, SESSION
 
 
@@ -67,6 +69,7 @@ Buttons.__table__.create(checkfirst=True)
 CUST_FILT_LOCK = threading.RLock()
 BUTTON_LOCK = threading.RLock()
 CHAT_FILTERS = {}
+CHAT_FILTER_MATCHERS = {}
 
 
 def get_all_filters():
@@ -98,7 +101,8 @@ def add_filter(chat_id, keyword, reply, is_sticker=False, is_document=False, is_
 
         if keyword not in CHAT_FILTERS.get(str(chat_id), []):
             CHAT_FILTERS[str(chat_id)] = sorted(CHAT_FILTERS.get(str(chat_id), []) + [keyword],
-                                                key=lambda x: (-len(x), x))
+                                                key=trigger_sort_key)
+            __rebuild_chat_matcher(str(chat_id))
 
         SESSION.add(filt)
         SESSION.commit()
@@ -114,6 +118,7 @@ def remove_filter(chat_id, keyword):
         if filt:
             if keyword in CHAT_FILTERS.get(str(chat_id), []):  # Sanity check
                 CHAT_FILTERS.get(str(chat_id), []).remove(keyword)
+                __rebuild_chat_matcher(str(chat_id))
 
             with BUTTON_LOCK:
                 prev_buttons = SESSION.query(Buttons).filter(Buttons.chat_id == str(chat_id),
@@ -133,6 +138,14 @@ def get_chat_triggers(chat_id):
     return CHAT_FILTERS.get(str(chat_id), set())
 
 
+def find_chat_trigger(chat_id, text, folded=False):
+    """Return the highest priority trigger of this chat found in the text, or None."""
+    matcher = CHAT_FILTER_MATCHERS.get(str(chat_id))
+    if not matcher:
+        return None
+    return matcher.best(text, folded)
+
+
 def get_chat_filters(chat_id):
     try:
         return SESSION.query(CustomFilters).filter(CustomFilters.chat_id == str(chat_id)).order_by(
@@ -177,6 +190,16 @@ def num_chats():
         SESSION.close()
 
 
+def __rebuild_chat_matcher(chat_id):
+    # only the edited chat is recompiled; every other chat keeps its matcher.
+    triggers = CHAT_FILTERS.get(chat_id)
+    if triggers:
+        CHAT_FILTER_MATCHERS[chat_id] = TriggerMatcher(triggers)
+    else:
+        CHAT_FILTER_MATCHERS.pop(chat_id, None)
+    set_chat_feature(chat_id, "filters", bool(triggers))
+
+
 def __load_chat_filters():
     global CHAT_FILTERS
     try:
@@ -188,7 +211,9 @@ def __load_chat_filters():
         for x in all_filters:
             CHAT_FILTERS[x.chat_id] += [x.keyword]
 
-        CHAT_FILTERS = {x: sorted(set(y), key=lambda i: (-len(i), i)) for x, y in CHAT_FILTERS.items()}
+        CHAT_FILTERS = {x: sorted(set(y), key=trigger_sort_key) for x, y in CHAT_FILTERS.items()}
+        for chat_id in CHAT_FILTERS:
+            __rebuild_chat_matcher(chat_id)
 
     finally:
         SESSION.close()
@@ -202,6 +227,8 @@ def migrate_chat(old_chat_id, new_chat_id):
         SESSION.commit()
         CHAT_FILTERS[str(new_chat_id)] = CHAT_FILTERS[str(old_chat_id)]
         del CHAT_FILTERS[str(old_chat_id)]
+        __rebuild_chat_matcher(str(old_chat_id))
+        __rebuild_chat_matcher(str(new_chat_id))
 
         with BUTTON_LOCK:
             chat_buttons = SESSION.query(Buttons).filter(Buttons.chat_id == str(old_chat_id)).all()
@@ -3,6 +3,7 @@ import threading
 
 from sqlalchemy import Column, String, Boolean
 
+from tg_bot.modules.helper_funcs.chat_features import set_chat_feature
 from tg_bot.modules.sql import SESSION, BASE
 
 
@@ -73,6 +74,50 @@ Restrictions.__table__.create(checkfirst=True)
 PERM_LOCK = threading.RLock()
 RESTR_LOCK = threading.RLock()
 
+# Each lock type is one bit, so checking a lock is a single AND against the chat's mask.
+LOCK_BITS = {lock_type: 1 << i for i, lock_type in enumerate(("sticker", "audio", "voice", "document", "video",
+                                                               "videonote", "contact", "photo", "gif", "url",
+                                                               "bots", "forward", "game", "location"))}
+# NOTE: "previews" is stored in the "preview" column.
+RESTR_BITS = {"messages": 1 << 0,
+              "media": 1 << 1,
+              "other": 1 << 2,
+              "previews": 1 << 3}
+RESTR_BITS["all"] = RESTR_BITS["messages"] | RESTR_BITS["media"] | RESTR_BITS["other"] | RESTR_BITS["previews"]
+
+# chat_id -> bitmask of locked types / restrictions. Chats without any locks have no entry.
+CHAT_LOCKS = {}
+CHAT_RESTRICTIONS = {}
+
+
+def __perm_mask(perm):
+    mask = 0
+    for lock_type, bit in LOCK_BITS.items():
+        if getattr(perm, lock_type):
+            mask |= bit
+    return mask
+
+
+def __restr_mask(restr):
+    mask = 0
+    if restr.messages:
+        mask |= RESTR_BITS["messages"]
+    if restr.media:
+        mask |= RESTR_BITS["media"]
+    if restr.other:
+        mask |= RESTR_BITS["other"]
+    if restr.preview:
+        mask |= RESTR_BITS["previews"]
+    return mask
+
+
+def __set_mask(cache, feature, chat_id, mask):
+    if mask:
+        cache[str(chat_id)] = mask
+    else:
+        cache.pop(str(chat_id), None)
+    set_chat_feature(chat_id, feature, bool(mask))
+
 
 def init_permissions(chat_id, reset=False):
     curr_perm = SESSION.query(Permissions).get(str(chat_id))
@@ -131,8 +176,10 @@ def update_lock(chat_id, lock_type, locked):
         elif lock_type == 'location':
             curr_perm.location = locked
 
+        mask = __perm_mask(curr_perm)
         SESSION.add(curr_perm)
         SESSION.commit()
+        __set_mask(CHAT_LOCKS, "locks", chat_id, mask)
 
 
 def update_restriction(chat_id, restr_type, locked):
@@ -154,64 +201,28 @@ def update_restriction(chat_id, restr_type, locked):
             curr_restr.media = locked
             curr_restr.other = locked
             curr_restr.preview = locked
+        mask = __restr_mask(curr_restr)
         SESSION.add(curr_restr)
         SESSION.commit()
+        __set_mask(CHAT_RESTRICTIONS, "restrictions", chat_id, mask)
 
 
 def is_locked(chat_id, lock_type):
-    curr_perm = SESSION.query(Permissions).get(str(chat_id))
-    SESSION.close()
-
-    if not curr_perm:
-        return False
-
-    elif lock_type == "sticker":
-        return curr_perm.sticker
-    elif lock_type == "photo":
-        return curr_perm.photo
-    elif lock_type == "audio":
-        return curr_perm.audio
-    elif lock_type == "voice":
-        return curr_perm.voice
-    elif lock_type == "contact":
-        return curr_perm.contact
-    elif lock_type == "video":
-        return curr_perm.video
-    elif lock_type == "videonote":
-        return curr_perm.videonote
-    elif lock_type == "document":
-        return curr_perm.document
-    elif lock_type == "gif":
-        return curr_perm.gif
-    elif lock_type == "url":
-        return curr_perm.url
-    elif lock_type == "bots":
-        return curr_perm.bots
-    elif lock_type == "forward":
-        return curr_perm.forward
-    elif lock_type == "game":
-        return curr_perm.game
-    elif lock_type == "location":
-        return curr_perm.location
+    bit = LOCK_BITS.get(lock_type, 0)
+    return bool(CHAT_LOCKS.get(str(chat_id), 0) & bit)
 
 
 def is_restr_locked(chat_id, lock_type):
-    curr_restr = SESSION.query(Restrictions).get(str(chat_id))
-    SESSION.close()
+    bits = RESTR_BITS.get(lock_type, 0)
+    return bool(bits) and (CHAT_RESTRICTIONS.get(str(chat_id), 0) & bits) == bits
+
 
-    if not curr_restr:
-        return False
+def get_lock_mask(chat_id):
+    return CHAT_LOCKS.get(str(chat_id), 0)
 
-    if lock_type == "messages":
-        return curr_restr.messages
-    elif lock_type == "media":
-        return curr_restr.media
-    elif lock_type == "other":
-        return curr_restr.other
-    elif lock_type == "previews":
-        return curr_restr.preview
-    elif lock_type == "all":
-        return curr_restr.messages and curr_restr.media and curr_restr.other and curr_restr.preview
+
+def get_restr_mask(chat_id):
+    return CHAT_RESTRICTIONS.get(str(chat_id), 0)
 
 
 def get_locks(chat_id):
@@ -233,10 +244,34 @@ def migrate_chat(old_chat_id, new_chat_id):
         perms = SESSION.query(Permissions).get(str(old_chat_id))
         if perms:
             perms.chat_id = str(new_chat_id)
+            __set_mask(CHAT_LOCKS, "locks", new_chat_id, CHAT_LOCKS.get(str(old_chat_id), 0))
+            __set_mask(CHAT_LOCKS, "locks", old_chat_id, 0)
         SESSION.commit()
 
     with RESTR_LOCK:
         rest = SESSION.query(Restrictions).get(str(old_chat_id))
         if rest:
             rest.chat_id = str(new_chat_id)
+            __set_mask(CHAT_RESTRICTIONS, "restrictions", new_chat_id, CHAT_RESTRICTIONS.get(str(old_chat_id), 0))
+            __set_mask(CHAT_RESTRICTIONS, "restrictions", old_chat_id, 0)
         SESSION.commit()
+
+
+def __load_lock_masks():
+    global CHAT_LOCKS, CHAT_RESTRICTIONS
+    try:
+        CHAT_LOCKS = {perm.chat_id: __perm_mask(perm) for perm in SESSION.query(Permissions).all()}
+        CHAT_RESTRICTIONS = {restr.chat_id: __restr_mask(restr) for restr in SESSION.query(Restrictions).all()}
+
+        CHAT_LOCKS = {chat_id: mask for chat_id, mask in CHAT_LOCKS.items() if mask}
+        CHAT_RESTRICTIONS = {chat_id: mask for chat_id, mask in CHAT_RESTRICTIONS.items() if mask}
+
+        for chat_id in CHAT_LOCKS:
+            set_chat_feature(chat_id, "locks", True)
+        for chat_id in CHAT_RESTRICTIONS:
+            set_chat_feature(chat_id, "restrictions", True)
+    finally:
+        SESSION.close()
+
+
+__load_lock_masks()
@@ -1,6 +1,7 @@
 import threading
+from array import array
 
-from sqlalchemy import Column, UnicodeText, Integer
+from sqlalchemy import Column, UnicodeText, Integer, LargeBinary, String
 
 from tg_bot.modules.sql import BASE, SESSION
 
@@ -10,6 +11,7 @@ class RSS(BASE):
     id = Column(Integer, primary_key=True)
     chat_id = Column(UnicodeText, nullable=False)
     feed_link = Column(UnicodeText)
+    # only used for feeds which don't have an RSSSeen row yet
     old_entry_link = Column(UnicodeText)
 
     def __init__(self, chat_id, feed_link, old_entry_link):
@@ -23,8 +25,49 @@ class RSS(BASE):
                                                                                    self.old_entry_link)
 
 
+class RSSSeen(BASE):
+    __tablename__ = "rss_seen"
+    feed_link = Column(UnicodeText, primary_key=True)
+    # 64 bit hashes of the entries' guids, oldest first, packed as array('q').tobytes()
+    hashes = Column(LargeBinary, nullable=False)
+
+    def __init__(self, feed_link, hashes):
+        self.feed_link = feed_link
+        self.hashes = hashes
+
+    def __repr__(self):
+        return "<RSS seen entries for {} ({} bytes)>".format(self.feed_link, len(self.hashes))
+
+
+class RSSDigest(BASE):
+    __tablename__ = "rss_digest"
+    chat_id = Column(String(14), primary_key=True)
+    feed_link = Column(UnicodeText, primary_key=True)
+
+    def __init__(self, chat_id, feed_link):
+        self.chat_id = str(chat_id)
+        self.feed_link = feed_link
+
+    def __repr__(self):
+        return "<RSS digest for chatID {} at feed_link {}>".format(self.chat_id, self.feed_link)
+
+
 RSS.__table__.create(checkfirst=True)
+RSSSeen.__table__.create(checkfirst=True)
+RSSDigest.__table__.create(checkfirst=True)
 INSERTION_LOCK = threading.RLock()
+SEEN_LOCK = threading.RLock()
+DIGEST_LOCK = threading.RLock()
+
+# How many entry hashes are remembered per feed. Entries still in the feed are always kept; older ones go first.
+MAX_SEEN_PER_FEED = 200
+
+# feed_link -> {chat_id: old_entry_link}; one fetch of a feed serves every chat listed under it
+SUBSCRIPTIONS = {}
+# feed_link -> array('q') of seen entry hashes, oldest first
+SEEN_ENTRIES = {}
+# (chat_id, feed_link) of the subscriptions which get their new entries as one digest message per update
+DIGESTS = set()
 
 
 def check_url_availability(tg_chat_id, tg_feed_link):
@@ -41,6 +84,7 @@ def add_url(tg_chat_id, tg_feed_link, tg_old_entry_link):
 
         SESSION.add(action)
         SESSION.commit()
+        SUBSCRIPTIONS.setdefault(tg_feed_link, {})[tg_chat_id] = tg_old_entry_link
 
 
 def remove_url(tg_chat_id, tg_feed_link):
@@ -51,6 +95,13 @@ def remove_url(tg_chat_id, tg_feed_link):
             SESSION.delete(row)
 
         SESSION.commit()
+        set_digest(tg_chat_id, tg_feed_link, False)
+
+        subscribers = SUBSCRIPTIONS.get(tg_feed_link, {})
+        subscribers.pop(tg_chat_id, None)
+        if not subscribers:
+            SUBSCRIPTIONS.pop(tg_feed_link, None)
+            forget_seen_entries(tg_feed_link)
 
 
 def get_urls(tg_chat_id):
@@ -60,19 +111,108 @@ def get_urls(tg_chat_id):
         SESSION.close()
 
 
-def get_all():
+def get_subscriptions():
+    """Return a snapshot of the subscription index: feed_link -> {chat_id: old_entry_link}."""
+    with INSERTION_LOCK:
+        return {feed_link: dict(subscribers) for feed_link, subscribers in SUBSCRIPTIONS.items()}
+
+
+def get_seen_entries(tg_feed_link):
+    """Return the set of seen entry hashes of a feed, or None if its entries have never been recorded."""
+    seen = SEEN_ENTRIES.get(tg_feed_link)
+    return set(seen) if seen is not None else None
+
+
+def set_seen_entries(tg_feed_link, entry_hashes):
+    """
+    Record a feed's current entries as seen.
+
+    Args:
+        tg_feed_link: The feed.
+        entry_hashes: Hashes of every entry currently in the feed, newest first.
+    """
+    with SEEN_LOCK:
+        current = set(entry_hashes)
+        old = SEEN_ENTRIES.get(tg_feed_link, array('q'))
+        seen = array('q', (entry_hash for entry_hash in old if entry_hash not in current))
+        seen.extend(reversed(entry_hashes))
+        if len(seen) > MAX_SEEN_PER_FEED:
+            seen = seen[-MAX_SEEN_PER_FEED:]
+
+        try:
+            SESSION.merge(RSSSeen(tg_feed_link, seen.tobytes()))
+            SESSION.commit()
+        finally:
+            SESSION.close()
+        SEEN_ENTRIES[tg_feed_link] = seen
+
+
+def forget_seen_entries(tg_feed_link):
+    with SEEN_LOCK:
+        try:
+            row = SESSION.query(RSSSeen).get(tg_feed_link)
+            if row:
+                SESSION.delete(row)
+                SESSION.commit()
+        finally:
+            SESSION.close()
+        SEEN_ENTRIES.pop(tg_feed_link, None)
+
+
+def set_digest(tg_chat_id, tg_feed_link, enabled):
+    with DIGEST_LOCK:
+        try:
+            row = SESSION.query(RSSDigest).get((str(tg_chat_id), tg_feed_link))
+            if enabled and not row:
+                SESSION.add(RSSDigest(tg_chat_id, tg_feed_link))
+            elif not enabled and row:
+                SESSION.delete(row)
+            SESSION.commit()
+        finally:
+            SESSION.close()
+
+        if enabled:
+            DIGESTS.add((str(tg_chat_id), tg_feed_link))
+        else:
+            DIGESTS.discard((str(tg_chat_id), tg_feed_link))
+
+
+def is_digest(tg_chat_id, tg_feed_link):
+    return (str(tg_chat_id), tg_feed_link) in DIGESTS
+
+
+def __load_subscriptions():
+    global SUBSCRIPTIONS
     try:
-        return SESSION.query(RSS).all()
+        subscriptions = {}
+        for row in SESSION.query(RSS).all():
+            subscriptions.setdefault(row.feed_link, {})[row.chat_id] = row.old_entry_link
+        SUBSCRIPTIONS = subscriptions
     finally:
         SESSION.close()
 
 
-def update_url(row_id, new_entry_links):
-    with INSERTION_LOCK:
-        row = SESSION.query(RSS).get(row_id)
+def __load_seen_entries():
+    global SEEN_ENTRIES
+    try:
+        seen_entries = {}
+        for row in SESSION.query(RSSSeen).all():
+            seen = array('q')
+            seen.frombytes(row.hashes)
+            seen_entries[row.feed_link] = seen
+        SEEN_ENTRIES = seen_entries
+    finally:
+        SESSION.close()
 
-        # set the new old_entry_link with the latest update from the RSS Feed
-        row.old_entry_link = new_entry_links[0]
 
-        # commit the changes to the DB
-        SESSION.commit()
+def __load_digests():
+    global DIGESTS
+    try:
+        DIGESTS = {(row.chat_id, row.feed_link) for row in SESSION.query(RSSDigest).all()}
+    finally:
+        SESSION.close()
+
+
+__load_subscriptions()
+__load_seen_entries()
+__load_digests()
@@ -1,6 +1,8 @@
 import threading
+from collections import OrderedDict
 
 from sqlalchemy import Column, Integer, UnicodeText, String, ForeignKey, UniqueConstraint, func
+from sqlalchemy.dialects import postgresql, sqlite
 
 from tg_bot import dispatcher
 from tg_bot.modules.sql import BASE, SESSION
@@ -57,11 +59,44 @@ class ChatMembers(BASE):
                                                             self.chat.chat_name, self.chat.chat_id)
 
 
+class DeadChats(BASE):
+    __tablename__ = "dead_chats"
+    chat_id = Column(String(14), primary_key=True)
+    reason = Column(UnicodeText)
+
+    def __init__(self, chat_id, reason=None):
+        self.chat_id = str(chat_id)
+        self.reason = reason
+
+    def __repr__(self):
+        return "<Dead chat {} ({})>".format(self.chat_id, self.reason)
+
+
 Users.__table__.create(checkfirst=True)
 Chats.__table__.create(checkfirst=True)
 ChatMembers.__table__.create(checkfirst=True)
+DeadChats.__table__.create(checkfirst=True)
 
 INSERTION_LOCK = threading.RLock()
+DEAD_CHATS_LOCK = threading.RLock()
+
+# chats the bot can no longer send to (kicked, blocked, deleted); skipped by broadcasts until they're heard from again
+DEAD_CHATS = set()
+
+# Write-behind buffer for update_user: upserts are collected here, merged, and written in bulk by flush_user_buffer.
+BUFFER_LOCK = threading.RLock()
+BUFFERED_USERS = {}  # user_id -> username
+BUFFERED_CHATS = {}  # chat_id -> chat_name
+BUFFERED_MEMBERS = set()  # (chat_id, user_id)
+
+# Bounded LRU of what was last written, so that buffer_user can skip rows that haven't changed.
+SEEN_CACHE_SIZE = 50000
+SEEN_USERS = OrderedDict()  # user_id -> username
+SEEN_CHATS = OrderedDict()  # chat_id -> chat_name
+SEEN_MEMBERS = OrderedDict()  # (chat_id, user_id) -> True
+SEEN_HITS = 0
+SEEN_MISSES = 0
+_NOT_SEEN = object()
 
 
 def ensure_bot_in_db():
@@ -103,6 +138,138 @@ def update_user(user_id, username, chat_id=None, chat_name=None):
         SESSION.commit()
 
 
+def __seen(cache, key, value):
+    # True if this key was last seen with the same value; either way, remember it as the latest.
+    if cache.get(key, _NOT_SEEN) == value:
+        cache.move_to_end(key)
+        return True
+
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > SEEN_CACHE_SIZE:
+        cache.popitem(last=False)
+    return False
+
+
+def __forget_seen(chat_id=None, user_id=None):
+    with BUFFER_LOCK:
+        if user_id is not None:
+            SEEN_USERS.pop(user_id, None)
+        if chat_id is not None:
+            SEEN_CHATS.pop(str(chat_id), None)
+        for key in [key for key in SEEN_MEMBERS if key[0] == str(chat_id) or key[1] == user_id]:
+            del SEEN_MEMBERS[key]
+
+
+def get_seen_cache_stats():
+    """Return how many buffer_user calls were skipped as unchanged (hits), and how many were not (misses)."""
+    return SEEN_HITS, SEEN_MISSES
+
+
+def buffer_user(user_id, username, chat_id=None, chat_name=None):
+    """Same as update_user, but only queues the upsert; it is written out by the next flush_user_buffer."""
+    global SEEN_HITS, SEEN_MISSES
+    if chat_id and str(chat_id) in DEAD_CHATS:
+        revive_chat(chat_id)  # a message arrived from it, so the bot is back in there
+
+    with BUFFER_LOCK:
+        changed = not __seen(SEEN_USERS, user_id, username)
+        if chat_id and chat_name:
+            changed |= not __seen(SEEN_CHATS, str(chat_id), chat_name)
+            changed |= not __seen(SEEN_MEMBERS, (str(chat_id), user_id), True)
+
+        if not changed:
+            SEEN_HITS += 1
+            return
+        SEEN_MISSES += 1
+
+        BUFFERED_USERS[user_id] = username
+        if not chat_id or not chat_name:
+            return
+
+        BUFFERED_CHATS[str(chat_id)] = chat_name
+        BUFFERED_MEMBERS.add((str(chat_id), user_id))
+
+
+# dialects with INSERT ... ON CONFLICT; the rest get a per-row merge
+UPSERT_DIALECTS = {"postgresql": postgresql, "sqlite": sqlite}
+
+
+def __upsert(dialect_name, table, index_elements, set_columns=()):
+    stmt = UPSERT_DIALECTS[dialect_name].insert(table)
+
+    if set_columns:
+        return stmt.on_conflict_do_update(index_elements=index_elements,
+                                          set_={col: getattr(stmt.excluded, col) for col in set_columns})
+    return stmt.on_conflict_do_nothing(index_elements=index_elements)
+
+
+def __take_user_buffer():
+    global BUFFERED_USERS, BUFFERED_CHATS, BUFFERED_MEMBERS
+    with BUFFER_LOCK:
+        batch = BUFFERED_USERS, BUFFERED_CHATS, BUFFERED_MEMBERS
+        BUFFERED_USERS, BUFFERED_CHATS, BUFFERED_MEMBERS = {}, {}, set()
+    return batch
+
+
+def __return_user_buffer(users, chats, members):
+    # put a failed batch back, without overwriting anything newer that arrived meanwhile
+    with BUFFER_LOCK:
+        for user_id, username in users.items():
+            BUFFERED_USERS.setdefault(user_id, username)
+        for chat_id, chat_name in chats.items():
+            BUFFERED_CHATS.setdefault(chat_id, chat_name)
+        BUFFERED_MEMBERS.update(members)
+
+
+def __user_buffer_statements(dialect_name, users, chats, members):
+    yield (__upsert(dialect_name, Users.__table__, ["user_id"], ["username"]),
+           [{"user_id": user_id, "username": username} for user_id, username in users.items()])
+    if chats:
+        yield (__upsert(dialect_name, Chats.__table__, ["chat_id"], ["chat_name"]),
+               [{"chat_id": chat_id, "chat_name": name} for chat_id, name in chats.items()])
+    if members:
+        yield (__upsert(dialect_name, ChatMembers.__table__, ["chat", "user"]),
+               [{"chat": chat_id, "user": user_id} for chat_id, user_id in members])
+
+
+def __merge_user_buffer(users, chats, members):
+    for user_id, username in users.items():
+        SESSION.merge(Users(user_id, username))
+    for chat_id, chat_name in chats.items():
+        SESSION.merge(Chats(chat_id, chat_name))
+    SESSION.flush()
+    for chat_id, user_id in members:
+        if not SESSION.query(ChatMembers).filter(ChatMembers.chat == chat_id, ChatMembers.user == user_id).first():
+            SESSION.add(ChatMembers(chat_id, user_id))
+
+
+def flush_user_buffer():
+    """
+    Write all buffered users, chats and memberships: as one bulk INSERT ... ON CONFLICT per table on postgres and
+    sqlite, and row by row on other databases.
+    """
+    users, chats, members = __take_user_buffer()
+    if not users:
+        return
+
+    with INSERTION_LOCK:
+        try:
+            dialect_name = SESSION.bind.dialect.name
+            if dialect_name in UPSERT_DIALECTS:
+                for stmt, params in __user_buffer_statements(dialect_name, users, chats, members):
+                    SESSION.execute(stmt, params)
+            else:
+                __merge_user_buffer(users, chats, members)
+            SESSION.commit()
+        except Exception:
+            SESSION.rollback()
+            __return_user_buffer(users, chats, members)
+            raise
+        finally:
+            SESSION.close()
+
+
 def get_userid_by_name(username):
     try:
         return SESSION.query(Users).filter(func.lower(Users.username) == username.lower()).all()
@@ -131,6 +298,59 @@ def get_all_chats():
         SESSION.close()
 
 
+def get_live_chat_ids_after(chat_id, limit):
+    """Return up to limit chat ids sorting after chat_id, in order, skipping dead chats."""
+    try:
+        dead = SESSION.query(DeadChats.chat_id)
+        rows = SESSION.query(Chats.chat_id).filter(Chats.chat_id > str(chat_id), ~Chats.chat_id.in_(dead)) \
+            .order_by(Chats.chat_id).limit(limit).all()
+        return [row.chat_id for row in rows]
+    finally:
+        SESSION.close()
+
+
+def mark_chat_dead(chat_id, reason=None):
+    with DEAD_CHATS_LOCK:
+        SESSION.merge(DeadChats(str(chat_id), reason))
+        SESSION.commit()
+        DEAD_CHATS.add(str(chat_id))
+
+
+def revive_chat(chat_id):
+    with DEAD_CHATS_LOCK:
+        dead = SESSION.query(DeadChats).get(str(chat_id))
+        if dead:
+            SESSION.delete(dead)
+            SESSION.commit()
+        else:
+            SESSION.close()
+        DEAD_CHATS.discard(str(chat_id))
+
+
+def is_chat_dead(chat_id):
+    return str(chat_id) in DEAD_CHATS
+
+
+def num_dead_chats():
+    return len(DEAD_CHATS)
+
+
+def get_user_chat_ids(user_id):
+    try:
+        return [row.chat for row in SESSION.query(ChatMembers.chat).filter(ChatMembers.user == int(user_id)).all()]
+    finally:
+        SESSION.close()
+
+
+def get_memberships(user_ids):
+    """Return (chat_id, user_id) pairs for every chat any of the given users has been seen in."""
+    try:
+        return [(row.chat, row.user) for row in
+                SESSION.query(ChatMembers.chat, ChatMembers.user).filter(ChatMembers.user.in_(list(user_ids))).all()]
+    finally:
+        SESSION.close()
+
+
 def get_user_num_chats(user_id):
     try:
         return SESSION.query(ChatMembers).filter(ChatMembers.user == int(user_id)).count()
@@ -153,6 +373,8 @@ def num_users():
 
 
 def migrate_chat(old_chat_id, new_chat_id):
+    flush_user_buffer()  # don't let buffered rows for the old chat id land after the migration
+    __forget_seen(chat_id=old_chat_id)
     with INSERTION_LOCK:
         chat = SESSION.query(Chats).get(str(old_chat_id))
         if chat:
@@ -168,11 +390,25 @@ def migrate_chat(old_chat_id, new_chat_id):
 
         SESSION.commit()
 
+    if str(old_chat_id) in DEAD_CHATS:
+        revive_chat(old_chat_id)
+
+
+def __load_dead_chats():
+    global DEAD_CHATS
+    try:
+        DEAD_CHATS = {chat.chat_id for chat in SESSION.query(DeadChats).all()}
+    finally:
+        SESSION.close()
+
 
 ensure_bot_in_db()
+__load_dead_chats()
 
 
 def del_user(user_id):
+    flush_user_buffer()
+    __forget_seen(user_id=user_id)
     with INSERTION_LOCK:
         curr = SESSION.query(Users).get(user_id)
         if curr:
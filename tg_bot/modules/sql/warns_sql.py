@@ -3,6 +3,7 @@ import threading
 from sqlalchemy import Integer, Column, String, UnicodeText, func, distinct, Boolean
 from sqlalchemy.dialects import postgresql
 
+from tg_bot.modules.helper_funcs.chat_features import set_chat_feature
 from tg_bot.modules.sql import SESSION, BASE
 
 
@@ -136,6 +137,7 @@ def add_warn_filter(chat_id, keyword, reply):
         if keyword not in WARN_FILTERS.get(str(chat_id), []):
             WARN_FILTERS[str(chat_id)] = sorted(WARN_FILTERS.get(str(chat_id), []) + [keyword],
                                                 key=lambda x: (-len(x), x))
+        set_chat_feature(chat_id, "warn_filters", True)
 
         SESSION.merge(warn_filt)  # merge to avoid duplicate key issues
         SESSION.commit()
@@ -147,6 +149,7 @@ def remove_warn_filter(chat_id, keyword):
         if warn_filt:
             if keyword in WARN_FILTERS.get(str(chat_id), []):  # sanity check
                 WARN_FILTERS.get(str(chat_id), []).remove(keyword)
+                set_chat_feature(chat_id, "warn_filters", bool(WARN_FILTERS.get(str(chat_id))))
 
             SESSION.delete(warn_filt)
             SESSION.commit()
@@ -256,6 +259,8 @@ def __load_chat_warn_filters():
             WARN_FILTERS[x.chat_id] += [x.keyword]
 
         WARN_FILTERS = {x: sorted(set(y), key=lambda i: (-len(i), i)) for x, y in WARN_FILTERS.items()}
+        for chat_id, keywords in WARN_FILTERS.items():
+            set_chat_feature(chat_id, "warn_filters", bool(keywords))
 
     finally:
         SESSION.close()
@@ -275,6 +280,8 @@ def migrate_chat(old_chat_id, new_chat_id):
         SESSION.commit()
         WARN_FILTERS[str(new_chat_id)] = WARN_FILTERS[str(old_chat_id)]
         del WARN_FILTERS[str(old_chat_id)]
+        set_chat_feature(old_chat_id, "warn_filters", False)
+        set_chat_feature(new_chat_id, "warn_filters", bool(WARN_FILTERS[str(new_chat_id)]))
 
     with WARN_SETTINGS_LOCK:
         chat_settings = SESSION.query(WarnSettings).filter(WarnSettings.chat_id == str(old_chat_id)).all()
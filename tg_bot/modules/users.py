@@ -1,91 +1,143 @@
+import asyncio
+import atexit
+import time
 from io import BytesIO
-from time import sleep
 from typing import Optional
 
 from telegram import TelegramError, Chat, Message
 from telegram import Update, Bot
-from telegram.error import BadRequest
+from telegram.error import BadRequest, Unauthorized
 from telegram.ext import MessageHandler, Filters, CommandHandler
 from telegram.ext.dispatcher import run_async
 
+import tg_bot.modules.sql.broadcast_sql as broadcast_sql
 import tg_bot.modules.sql.users_sql as sql
-from tg_bot import dispatcher, OWNER_ID, LOGGER
+from tg_bot import dispatcher, job_queue, OWNER_ID, LOGGER
+from tg_bot.modules.helper_funcs.extraction import get_user_id  # noqa: F401 - other modules import it from here
 from tg_bot.modules.helper_funcs.filters import CustomFilters
+from tg_bot.modules.helper_funcs.outbound import OUTBOUND, PRIORITY_BULK, PRIORITY_REPLY
+from tg_bot.modules.helper_funcs.update_context import get_update_context
 
 USERS_GROUP = 4
+# log_user only buffers its upserts; they are written to the db in bulk this often (in seconds).
+USER_FLUSH_INTERVAL = 5
 
-
-def get_user_id(username):
-    # ensure valid userid
-    if len(username) <= 5:
-        return None
-
-    if username.startswith('@'):
-        username = username[1:]
-
-    users = sql.get_userid_by_name(username)
-
-    if not users:
-        return None
-
-    elif len(users) == 1:
-        return users[0].user_id
-
-    else:
-        for user_obj in users:
-            try:
-                userdat = dispatcher.bot.get_chat(user_obj.user_id)
-                if userdat.username == username:
-                    return userdat.id
-
-            except BadRequest as excp:
-                if excp.message == 'Chat not found':
-                    pass
-                else:
-                    LOGGER.exception("Error extracting user ID")
-
-    return None
+# Broadcasts go out to this many chats at a time, checkpointing after each batch, and report progress this often
+# (in seconds).
+BROADCAST_CONCURRENCY = 20
+BROADCAST_BATCH_SIZE = 200
+BROADCAST_REPORT_INTERVAL = 60
+# Send errors meaning the chat is gone for good, so broadcasts should stop trying it.
+DEAD_CHAT_ERRORS = ("Chat not found", "Peer_id_invalid", "Group chat was deactivated", "Chat_id_invalid")
 
 
 @run_async
 def broadcast(bot: Bot, update: Update):
     to_send = update.effective_message.text.split(None, 1)
     if len(to_send) >= 2:
-        chats = sql.get_all_chats() or []
-        failed = 0
-        for chat in chats:
-            try:
-                bot.sendMessage(int(chat.chat_id), to_send[1])
-                sleep(0.1)
-            except TelegramError:
-                failed += 1
-                LOGGER.warning("Couldn't send broadcast to %s, group name %s", str(chat.chat_id), str(chat.chat_name))
-
-        update.effective_message.reply_text("Broadcast complete. {} groups failed to receive the message, probably "
-                                            "due to being kicked.".format(failed))
+        broadcast_id = broadcast_sql.new_broadcast(update.effective_chat.id, to_send[1])
+        job_queue.run_once(run_broadcast, 0, data=broadcast_id)
+        update.effective_message.reply_text("Broadcast #{} started, I'll report my progress here.".format(broadcast_id))
+
+
+async def send_broadcast(bot: Bot, chat_id: str, text: str) -> str:
+    """Send a broadcast message to one chat, and say how it went: "sent", "failed" or "dead"."""
+    try:
+        # rate limited by the outbound scheduler, which returns None if it had to drop the message
+        if await OUTBOUND.call(int(chat_id), PRIORITY_BULK, bot.send_message, int(chat_id), text) is None:
+            return "failed"
+        return "sent"
+    except Unauthorized as excp:
+        reason = excp.message
+    except BadRequest as excp:
+        if excp.message not in DEAD_CHAT_ERRORS:
+            LOGGER.warning("Couldn't send broadcast to %s: %s", chat_id, excp.message)
+            return "failed"
+        reason = excp.message
+    except TelegramError as excp:
+        LOGGER.warning("Couldn't send broadcast to %s: %s", chat_id, excp.message)
+        return "failed"
+
+    await asyncio.to_thread(sql.mark_chat_dead, chat_id, reason)
+    return "dead"
+
+
+async def run_broadcast(context):
+    broadcast_id = context.job.data
+    job = await asyncio.to_thread(broadcast_sql.get_broadcast, broadcast_id)
+    if not job or job.finished:
+        return
+
+    bot = context.bot
+    counts = {"sent": job.sent, "failed": job.failed, "dead": job.dead}
+    cursor = job.cursor
+    slots = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    last_report = time.monotonic()
+
+    async def send_one(chat_id):
+        async with slots:
+            return await send_broadcast(bot, chat_id, job.text)
+
+    async def report(text):
+        try:
+            await OUTBOUND.call(int(job.origin_chat_id), PRIORITY_REPLY, bot.send_message, int(job.origin_chat_id),
+                                text)
+        except TelegramError:
+            LOGGER.warning("Couldn't report progress of broadcast %s", broadcast_id)
+
+    while True:
+        chat_ids = await asyncio.to_thread(sql.get_live_chat_ids_after, cursor, BROADCAST_BATCH_SIZE)
+        if not chat_ids:
+            break
+
+        for result in await asyncio.gather(*(send_one(chat_id) for chat_id in chat_ids)):
+            counts[result] += 1
+
+        # at most one batch gets sent twice if we die before this checkpoint
+        cursor = chat_ids[-1]
+        await asyncio.to_thread(broadcast_sql.checkpoint_broadcast, broadcast_id, cursor,
+                                counts["sent"], counts["failed"], counts["dead"])
+
+        if time.monotonic() - last_report >= BROADCAST_REPORT_INTERVAL:
+            last_report = time.monotonic()
+            await report("Broadcast #{} in progress: {sent} sent, {failed} failed, {dead} dead chats "
+                         "so far.".format(broadcast_id, **counts))
+
+    await asyncio.to_thread(broadcast_sql.checkpoint_broadcast, broadcast_id, cursor,
+                            counts["sent"], counts["failed"], counts["dead"], True)
+    await report("Broadcast #{} complete. {sent} chats received it, {failed} failed, and {dead} chats were marked "
+                 "dead, probably due to me being kicked.".format(broadcast_id, **counts))
 
 
 @run_async
 def log_user(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    msg = update.effective_message  # type: Optional[Message]
+    ctx = get_update_context(update)
+    chat = ctx.chat  # type: Optional[Chat]
+    msg = ctx.message  # type: Optional[Message]
 
-    sql.update_user(msg.from_user.id,
+    sql.buffer_user(msg.from_user.id,
                     msg.from_user.username,
                     chat.id,
                     chat.title)
 
     if msg.reply_to_message:
-        sql.update_user(msg.reply_to_message.from_user.id,
+        sql.buffer_user(msg.reply_to_message.from_user.id,
                         msg.reply_to_message.from_user.username,
                         chat.id,
                         chat.title)
 
     if msg.forward_from:
-        sql.update_user(msg.forward_from.id,
+        sql.buffer_user(msg.forward_from.id,
                         msg.forward_from.username)
 
 
+async def flush_users(context):
+    try:
+        await asyncio.to_thread(sql.flush_user_buffer)
+    except Exception:
+        LOGGER.exception("Error while flushing the user buffer.")
+
+
 @run_async
 def chats(bot: Bot, update: Update):
     all_chats = sql.get_all_chats() or []
@@ -107,7 +159,10 @@ def __user_info__(user_id):
 
 
 def __stats__():
-    return "{} users, across {} chats".format(sql.num_users(), sql.num_chats())
+    hits, misses = sql.get_seen_cache_stats()
+    return "{} users, across {} chats ({} dead)\n" \
+           "{} user updates skipped as unchanged, {} written".format(sql.num_users(), sql.num_chats(),
+                                                                   sql.num_dead_chats(), hits, misses)
 
 
 def __gdpr__(user_id):
@@ -129,3 +184,10 @@ CHATLIST_HANDLER = CommandHandler("chatlist", chats, filters=CustomFilters.sudo_
 dispatcher.add_handler(USER_HANDLER, USERS_GROUP)
 dispatcher.add_handler(BROADCAST_HANDLER)
 dispatcher.add_handler(CHATLIST_HANDLER)
+
+job_queue.run_repeating(flush_users, interval=USER_FLUSH_INTERVAL, first=USER_FLUSH_INTERVAL)
+atexit.register(sql.flush_user_buffer)
+
+# pick up broadcasts that were interrupted by a restart
+for unfinished_id in broadcast_sql.get_unfinished_broadcasts():
+    job_queue.run_once(run_broadcast, 0, data=unfinished_id)